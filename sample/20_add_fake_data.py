@@ -31,7 +31,8 @@ if __name__ == "__main__":
         metadata = {"purpose": "prototype", "achievement": "completed"}
 
         subs_db = SubsMaterialsDatabase().\
-            initialize_with_dirs("Calc/MGI/mp-*", StructureNode)
+            initialize_with_dirs("Calc/MGI/mp-*", StructureNode,
+                                 batch_size=1000, max_workers=8)
         n = subs_db.count_documents()
         print("initial database size", n)
 
@@ -51,16 +52,16 @@ if __name__ == "__main__":
             count = 0
             subs_prefix = subs_elms_to_prefix(subs_elm)
 
-            for find in subs_db.find_subs_elems(subs_elm):
-                basedir = find["basedir"]
-                positionfilename = find["positionfile"]
+            for find in subs_db.find_subs_elems(subs_elm, as_record=True):
+                basedir = find.basedir
+                positionfilename = find.positionfile
                 struc = StructureNode(basedir)
                 current_dir = struc.get_currentdir()
                 positionfile_path = os.path.join(current_dir, positionfilename)
-                uuid = find["uuid"]
+                uuid = find.uuid
 
                 # load Structure
-                structure = SubsStructure.from_file(positionfile_path)
+                structure = SubsStructure.from_file_cached(positionfile_path)
 
                 # make Structure
                 structure2 = structure.substitute_elements(subs_elm)
@@ -82,6 +83,6 @@ if __name__ == "__main__":
 
     if "step2" in action:
         subs_db = SubsMaterialsDatabase().\
-                  initialize_with_dirs("Calc/MGI/mp-*", StructureNode)
+                  sync_with_dirs("Calc/MGI/mp-*", StructureNode)
         n = subs_db.count_documents()
         print("final database size", n)
@@ -1,68 +1,43 @@
-import os
+import argparse
 import random
-from pymatgen.core.structure import Structure
-from pymatgen.analysis.structure_matcher import StructureMatcher
+from functools import partial
 
-from subsMat.structure import SubsStructure
-from subsMat.node import subs_elms_to_prefix, StructureNode
+from subsMat.structure import structure_cache
+from subsMat.node import StructureNode
 from subsMat.database import SubsMaterialsDatabase
+from subsMat.substitution import SubstitutionEngine
 
 
 if __name__ == "__main__":
 
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--kind", default="cif",
+                           choices=StructureNode.STRUCTUREFILE_KINDS,
+                           help="kind of the structure file to place")
+    args = argparser.parse_args()
+
     random.seed(10)
 
     subs_db = SubsMaterialsDatabase()
+    n = subs_db.add_fingerprints(StructureNode)
+    print("fingerprints added", n)
 
     subs_elm_list = [[["Cu", "Fe"]]]
     subs_elm_list.append([["Cu", "Ni"]])
     subs_elm_list.append([["Cu", "Co"]])
 
-    for subs_elm in subs_elm_list:
-        print("substitute elements", subs_elm)
-
-        for x in subs_db.find_subs_elems(subs_elm):
-            basedir = x["basedir"]
-            positionfilename = x["positionfile"]
-            struc = StructureNode(basedir)
-            current_dir = struc.get_currentdir()
-            position_path = os.path.join(current_dir, positionfilename)
-            source_uuid = x["uuid"]
-            struc = SubsStructure.from_file(position_path)
-            new_struc = struc.substitute_elements(subs_elm)
-            new_basedir = ",".join([x["basedir"],
-                                   subs_elms_to_prefix(subs_elm)])
-            species = new_struc.element_list()
-            nspecies = len(species)
-
-            # make new structure if not matched (not already existed)
-
-            struc_matched = False
-
-            find_comp = subs_db.find({"nspecies": nspecies,
-                                      "species": species})
-            for y in find_comp:
-                basedir_comp = x["basedir"]
-                positionfilename_comp = y["positionfile"]
-                struc_comp = StructureNode(basedir_comp)
-                current_dir_comp = struc_comp.get_currentdir()
-                filename_comp = os.path.join(current_dir_comp,
-                                             positionfilename_comp)
-                struc_comp = Structure.from_file(filename_comp)
-                struc_matcher = StructureMatcher()
-                match = struc_matcher.fit(new_struc, struc_comp)
-                if match:
-                    struc_matched = True
-
-            if not struc_matched:
-                print("new_basedir", new_basedir)
-                metadata = {"purpose": "converged_ionic",
-                            "achievement": "to_relax"}
-                structurenode = StructureNode(new_basedir)
-                structurenode.place_files(new_struc, source_uuid=source_uuid,
-                                          metadata=metadata)
-                subs_db.add_files_under(new_basedir, StructureNode)
-
+    # make new structures if not matched (not already existed)
+    # and place them in {"purpose": "converged_ionic",
+    #                    "achievement": "to_relax"}
+    wrapperclass = partial(StructureNode, kind=args.kind)
+    engine = SubstitutionEngine(subs_db, wrapperclass)
+    report = engine.run(subs_elm_list, verbose=True)
+    print("substitution", {k: v for k, v in report.items()
+                           if k != "errors"})
+    for x in report["errors"]:
+        print("error", x)
+
+    print("structure cache", structure_cache.info())
     n = subs_db.count_documents()
     print("database size", n)
     n = subs_db.count_documents({"achievement": "to_relax"})
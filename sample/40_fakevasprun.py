@@ -14,8 +14,11 @@ if __name__ == "__main__":
         subs_db = SubsMaterialsDatabase()
         filterstring = {"purpose": "converged_ionic",
                         "achievement": "to_relax"}
-        for x in subs_db.find(filterstring):
-            id_ = x["_id"]
+        while True:
+            # claim a node so that other workers don't run it.
+            x = subs_db.claim(filterstring, lease_seconds=3600)
+            if x is None:
+                break
             # hostname = x["hostname"]
             basedir_prefix = x["basedir"]
             # struc = StructureNode(basedir_prefix)
@@ -24,10 +27,12 @@ if __name__ == "__main__":
 
             print("run", basedir_prefix)
             calc = fakeVaspRunNode(basedir_prefix)
-            calc.place_files()
-            calc.run()
-            subs_db.delete_one({"_id": id_})
-            subs_db.add_files_under(basedir_prefix, StructureNode)
+            # the metadata file of the new step is written once.
+            with calc.metadata_batch():
+                calc.place_files()
+                calc.run()
+            # the new step is made, so the document is replaced in place.
+            subs_db.update_files_under(basedir_prefix, StructureNode)
 
         n = subs_db.count_documents({"achievement": "running"})
         print(n, "running")
@@ -38,14 +38,28 @@ if __name__ == "__main__":
         subs_db = SubsMaterialsDatabase()
         result_list = []
         filterstring = {"purpose": "converged_ionic", "achievement": "running"}
-        for x in subs_db.find(filterstring):
-            id_ = x["_id"]
+        while True:
+            # claim a node so that other workers don't change it.
+            x = subs_db.claim(filterstring)
+            if x is None:
+                break
             # hostname = x["hostname"]
             basedir_prefix = x["basedir"]
             calc = fakeVaspRunNode(basedir_prefix)
-            result_list.append(calc.run_result())
-            subs_db.delete_one({"_id": id_})
-            subs_db.add_files_under(basedir_prefix, StructureNode)
+            try:
+                # the metadata file is changed by the transition
+                result = calc.write_result()
+                if subs_db.transition(x["uuid"], "running", "executed",
+                                      StructureNode) is None:
+                    # changed by another process, put the files back
+                    calc.remove_result()
+                    continue
+            except Exception:
+                calc.remove_result()
+                raise
+            finally:
+                subs_db.release(x["uuid"])
+            result_list.append(result)
 
         result = [x["converged_ionic"] for x in result_list]
         counter = Counter(result)
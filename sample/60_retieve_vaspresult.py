@@ -13,8 +13,8 @@ if __name__ == "__main__":
     filter = {"purpose": "converged_ionic", "achievement": "executed"}
 
     result_list = []
-    for x in subs_db.find(filter):
-        id_ = x["_id"]
+    for x in subs_db.find(filter,
+                          projection=["uuid", "basedir", "hostname"]):
         hostname = x["hostname"]
         basedir_prefix = x["basedir"]
         # current_dir = StructureNode(basedir_prefix).get_currentdir()
@@ -25,8 +25,8 @@ if __name__ == "__main__":
         result = calc.check_result()
         result_list.append(result)
 
-        subs_db.delete_one({"_id": id_})
-        subs_db.add_files_under(basedir_prefix, StructureNode)
+        subs_db.transition(x["uuid"], "executed", result["achievement"],
+                           StructureNode)
 
     print(len(result_list), "data processed.")
     result = [x["achievement"] for x in result_list]
@@ -0,0 +1,28 @@
+import argparse
+
+from subsMat.archive import pack_steps
+from subsMat.filestore import ManifestStore
+
+
+if __name__ == "__main__":
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--location", default="Calc/MGI/*",
+                           help="glob pattern of basedirs")
+    argparser.add_argument("--min_age", type=float, default=3600,
+                           help="seconds since a step was last changed")
+    argparser.add_argument("--manifest", default=None,
+                           help="root of the ManifestStore, e.g., Calc, "
+                           "if the metadata files are in the manifest")
+    args = argparser.parse_args()
+
+    store = None
+    if args.manifest is not None:
+        store = ManifestStore(args.manifest)
+
+    # pack the old steps into basedir/steps.zip
+    report = pack_steps(args.location, min_age=args.min_age, store=store,
+                        verbose=True)
+    print("pack", {k: v for k, v in report.items() if k != "errors"})
+    for x in report["errors"]:
+        print("error", x)
@@ -12,9 +12,12 @@ if __name__ == "__main__":
                                choices=["to_relax",
                                         "running", "executed",
                                         "completed"])
+        argparser.add_argument("--index_usage",
+                               default=False, action="store_true")
+        argparser.add_argument("--by", choices=["nspecies", "element"])
         args = argparser.parse_args()
 
-        return args.detail
+        return args.detail, args.index_usage, args.by
 
     def make_filterdict(action):
         """make filter string
@@ -39,19 +42,27 @@ if __name__ == "__main__":
             filterdic = {}
         return filterdic
 
-    action = parse_argument()
+    action, index_usage, by = parse_argument()
 
     subs_db = SubsMaterialsDatabase()
-    result = []
-    for process in ["all", "to_relax", "running", "executed", "completed"]:
-
-        filterdic = make_filterdict(process)
-        n = subs_db.count_documents(filterdic)
+    summary = subs_db.status_summary()
+    result = [["all", sum(summary.values())]]
+    for process in ["to_relax", "running", "executed", "completed"]:
+        n = sum([v for k, v in summary.items() if k[1] == process])
         result.append([process, n])
 
     print(result)
 
+    if by is not None:
+        for key, n in sorted(subs_db.status_summary(by=by).items(),
+                             key=lambda x: str(x[0])):
+            print(list(key), n)
+
     if action is not None:
         filterdic = make_filterdict(action)
         for doc in subs_db.find(filterdic):
             print(doc)
+
+    if index_usage:
+        for x in subs_db.index_usage():
+            print(x)
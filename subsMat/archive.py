@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import fcntl
+import os
+import shutil
+import time
+import zipfile
+from contextlib import contextmanager
+
+from .node import DirNode
+from .scanner import iter_dirs
+
+
+class StepArchive(object):
+    """zip archive of the old steps of a basedir
+
+    The step directories except the current step are packed into
+    basedir/ARCHIVE_NAME as members "{step}/{path}".
+    The central directory of the zip file is the index,
+    so a file of an old step is read without extracting the others.
+
+    pack() is safe to run while workers are active:
+    the current step and the steps changed in the last min_age seconds
+    are not packed, the archive is replaced atomically before
+    the directories are removed, and read() looks at the directory first
+    and then the archive.
+    Only one pack() runs for a basedir at a time by a lock file.
+
+    With a store such as ManifestStore, STORE_FILES of a step
+    not in its directory are read from the store, packed as
+    "{step}/{name}" and removed from the store with the directory.
+    """
+
+    ARCHIVE_NAME = "steps.zip"
+    LOCK_NAME = ".steps.lock"
+
+    # files of a step which may be kept in the store
+    STORE_FILES = ["metadata.json", "_uuid"]
+
+    def __init__(self, basedir, store=None):
+        """initialize StepArchive
+
+        Parameters
+        ----------
+        basedir: string
+            base directory of the node
+
+        store: LocalFileStore or ManifestStore (default: None)
+            store of the metadata files, see DirNode
+        """
+        self.basedir = basedir
+        self.store = store
+        self.filename = os.path.join(basedir, self.ARCHIVE_NAME)
+
+    def read_current_step(self):
+        """read current_step of the basedir now
+
+        Returns
+        -------
+        string: current_step
+        """
+        return DirNode(self.basedir, lazy=True,
+                       store=self.store).read_current_step()
+
+    def index(self):
+        """list the files in the archive
+
+        Returns
+        -------
+        dict: {step: a list of paths in the step}
+        """
+        index = {}
+        if not os.path.isfile(self.filename):
+            return index
+        with zipfile.ZipFile(self.filename) as zf:
+            for name in zf.namelist():
+                step, _, path = name.partition("/")
+                paths = index.setdefault(step, [])
+                if path != "" and not path.endswith("/"):
+                    paths.append(path)
+        return index
+
+    def steps(self):
+        """list the steps in the archive
+
+        Returns
+        -------
+        a list of string: steps
+        """
+        return sorted(self.index().keys())
+
+    def read(self, step, path):
+        """read a file of a step from the directory or the archive
+
+        Parameters
+        ----------
+        step: string
+            step, a subdirectory name of basedir
+
+        path: string
+            file name in the step, e.g., "metadata.json"
+
+        Returns
+        -------
+        bytes: the content
+
+        Raises
+        ------
+        FileNotFoundError if the file is in neither of them
+        """
+        filename = os.path.join(self.basedir, step, path)
+        try:
+            with open(filename, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            # the directory may be removed after it is packed
+            pass
+        name = "/".join([step] + path.split(os.sep))
+        try:
+            with zipfile.ZipFile(self.filename) as zf:
+                return zf.read(name)
+        except (FileNotFoundError, KeyError):
+            raise FileNotFoundError(filename)
+
+    def _last_modified(self, step):
+        """return the last mtime in the step in seconds
+        """
+        stepdir = os.path.join(self.basedir, step)
+        mtime = os.stat(stepdir).st_mtime
+        for dirpath, dirnames, filenames in os.walk(stepdir):
+            for name in dirnames + filenames:
+                try:
+                    mtime = max(mtime, os.lstat(
+                        os.path.join(dirpath, name)).st_mtime)
+                except FileNotFoundError:
+                    pass
+        if self.store is not None:
+            # the metadata file may not be in the directory
+            try:
+                mtime = max(mtime, self.store.mtime_ns(
+                    os.path.join(stepdir, "metadata.json")) / 1e9)
+            except FileNotFoundError:
+                pass
+        return mtime
+
+    def candidates(self, min_age=3600):
+        """list the steps to pack
+
+        Parameters
+        ----------
+        min_age: float
+            a step changed in the last min_age seconds isn't packed
+
+        Returns
+        -------
+        a list of string: steps
+        """
+        current_step = self.read_current_step()
+        now = time.time()
+        steps = []
+        with os.scandir(self.basedir) as it:
+            for entry in it:
+                if not entry.is_dir(follow_symlinks=False) or \
+                        entry.name == current_step or \
+                        entry.name.startswith("."):
+                    continue
+                try:
+                    if now - self._last_modified(entry.name) < min_age:
+                        continue
+                except FileNotFoundError:
+                    continue
+                steps.append(entry.name)
+        steps.sort()
+        return steps
+
+    @contextmanager
+    def _lock(self):
+        """hold the lock file of the basedir
+
+        Raises
+        ------
+        BlockingIOError if another process holds it
+        """
+        with open(os.path.join(self.basedir, self.LOCK_NAME), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _store_files(self, step):
+        """list STORE_FILES of step kept only in the store
+
+        Returns
+        -------
+        a list of string: file names
+        """
+        filenames = []
+        if self.store is None:
+            return filenames
+        stepdir = os.path.join(self.basedir, step)
+        for name in self.STORE_FILES:
+            filename = os.path.join(stepdir, name)
+            if not os.path.isfile(filename) and self.store.exists(filename):
+                filenames.append(filename)
+        return filenames
+
+    def _write(self, steps):
+        """write the archive with steps added
+
+        The archive is copied to a temporary file, steps are appended,
+        and it replaces the archive.
+
+        Returns
+        -------
+        a list of string: file names in the store which are packed
+        """
+        store_files = []
+        tmpfile = "{}.{}.tmp".format(self.filename, os.getpid())
+        try:
+            if os.path.isfile(self.filename):
+                shutil.copyfile(self.filename, tmpfile)
+                mode = "a"
+            else:
+                mode = "w"
+            with zipfile.ZipFile(tmpfile, mode,
+                                 compression=zipfile.ZIP_DEFLATED) as zf:
+                for step in steps:
+                    stepdir = os.path.join(self.basedir, step)
+                    for dirpath, dirnames, filenames in os.walk(stepdir):
+                        dirnames.sort()
+                        zf.write(dirpath, os.path.relpath(dirpath,
+                                                          self.basedir))
+                        for name in sorted(filenames):
+                            filename = os.path.join(dirpath, name)
+                            zf.write(filename,
+                                     os.path.relpath(filename, self.basedir))
+                    for filename in self._store_files(step):
+                        zf.writestr("/".join([step,
+                                              os.path.basename(filename)]),
+                                    self.store.read(filename))
+                        store_files.append(filename)
+            with open(tmpfile, "rb") as f:
+                os.fsync(f.fileno())
+            os.replace(tmpfile, self.filename)
+        except BaseException:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+            raise
+        return store_files
+
+    def pack(self, min_age=3600):
+        """pack the old steps into the archive and remove their directories
+
+        A step already in the archive isn't packed again,
+        and its directory, if any, isn't removed.
+
+        Parameters
+        ----------
+        min_age: float
+            a step changed in the last min_age seconds isn't packed
+
+        Returns
+        -------
+        a list of string: packed steps,
+            None if another process is packing the basedir
+        """
+        # no lock file is made for a basedir without old steps
+        if len(self.candidates(min_age)) == 0:
+            return []
+        try:
+            with self._lock():
+                packed = set(self.steps())
+                steps = [x for x in self.candidates(min_age)
+                         if x not in packed]
+                if len(steps) == 0:
+                    return []
+                store_files = self._write(steps)
+                # a step which became current meanwhile is kept
+                current_step = self.read_current_step()
+                steps = [x for x in steps if x != current_step]
+                for step in steps:
+                    shutil.rmtree(os.path.join(self.basedir, step))
+                for filename in store_files:
+                    if os.path.basename(os.path.dirname(filename)) in steps:
+                        self.store.remove(filename)
+                return steps
+        except BlockingIOError:
+            return None
+
+
+def pack_steps(location, min_age=3600, store=None, verbose=False):
+    """pack the old steps of the basedirs into their archives
+
+    Parameters
+    ----------
+    location: string
+        glob pattern of basedirs, e.g., "Calc/MGI/*"
+
+    min_age: float
+        a step changed in the last min_age seconds isn't packed
+
+    store: LocalFileStore or ManifestStore (default: None)
+        store of the metadata files, see DirNode
+
+    verbose: boolean
+        print packed steps
+
+    Returns
+    -------
+    dict: report
+        nbasedirs, npacked (steps), nlocked (basedirs packed by others),
+        and errors, a list of {"basedir", "errmsg"}
+    """
+    report = {"nbasedirs": 0, "npacked": 0, "nlocked": 0, "errors": []}
+    for basedir in iter_dirs(location):
+        report["nbasedirs"] += 1
+        try:
+            steps = StepArchive(basedir, store=store).pack(min_age)
+        except Exception as e:
+            report["errors"].append({"basedir": basedir, "errmsg": str(e)})
+            continue
+        if steps is None:
+            report["nlocked"] += 1
+            continue
+        report["npacked"] += len(steps)
+        if verbose:
+            for step in steps:
+                print("packed", os.path.join(basedir, step))
+    return report
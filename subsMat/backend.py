@@ -0,0 +1,1146 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import json
+import os
+import sqlite3
+import threading
+
+from pymongo import IndexModel, MongoClient, operations
+from pymongo.errors import BulkWriteError
+from pymongo.results import (BulkWriteResult, DeleteResult, InsertManyResult,
+                             InsertOneResult, UpdateResult)
+
+
+# {(uri, client options): (pid, MongoClient)} shared in the process
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(uri=None, **kwargs):
+    """get MongoClient shared in the process
+
+    One MongoClient, and so one connection pool, is made for each uri
+    and options.
+    A client made before fork() is not used in the child process,
+    and a new one is made instead.
+
+    Parameters
+    ----------
+    uri: string (default: None)
+        MongoDB URI, localhost if None
+
+    kwargs: dict
+        options to pass MongoClient(),
+        e.g., maxPoolSize, serverSelectionTimeoutMS
+
+    Returns
+    -------
+    MongoClient
+    """
+    key = (uri, tuple(sorted(kwargs.items())))
+    pid = os.getpid()
+    with _clients_lock:
+        entry = _clients.get(key)
+        if entry is None or entry[0] != pid:
+            entry = (pid, MongoClient(uri, **kwargs))
+            _clients[key] = entry
+        return entry[1]
+
+
+class InsertOne(operations.InsertOne):
+    """pymongo.InsertOne which SQLiteCollection.bulk_write() can read
+    """
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.operation = ("insert", document)
+
+
+class ReplaceOne(operations.ReplaceOne):
+    """pymongo.ReplaceOne which SQLiteCollection.bulk_write() can read
+    """
+
+    def __init__(self, filter, replacement, upsert=False):
+        super().__init__(filter, replacement, upsert=upsert)
+        self.operation = ("replace", filter, replacement, upsert)
+
+
+class UpdateOne(operations.UpdateOne):
+    """pymongo.UpdateOne which SQLiteCollection.bulk_write() can read
+    """
+
+    def __init__(self, filter, update, upsert=False):
+        super().__init__(filter, update, upsert=upsert)
+        self.operation = ("update_one", filter, update, upsert)
+
+
+class UpdateMany(operations.UpdateMany):
+    """pymongo.UpdateMany which SQLiteCollection.bulk_write() can read
+    """
+
+    def __init__(self, filter, update, upsert=False):
+        super().__init__(filter, update, upsert=upsert)
+        self.operation = ("update_many", filter, update, upsert)
+
+
+class DeleteOne(operations.DeleteOne):
+    """pymongo.DeleteOne which SQLiteCollection.bulk_write() can read
+    """
+
+    def __init__(self, filter):
+        super().__init__(filter)
+        self.operation = ("delete_one", filter)
+
+
+class DeleteMany(operations.DeleteMany):
+    """pymongo.DeleteMany which SQLiteCollection.bulk_write() can read
+    """
+
+    def __init__(self, filter):
+        super().__init__(filter)
+        self.operation = ("delete_many", filter)
+
+
+def make_backend(uri=None, database_name='elem_subst_database',
+                 collection_name='material_collection', client_options=None,
+                 write_concern=None, read_preference=None):
+    """make a backend from uri
+
+    Parameters
+    ----------
+    uri: string (default: None)
+        "sqlite:///path/to/file" for SQLiteBackend,
+        otherwise MongoDB URI for MongoBackend (localhost if None)
+
+    database_name: string
+        database name, not used by SQLiteBackend
+
+    collection_name: string
+        collection name, a table name for SQLiteBackend
+
+    client_options: dict (default: None)
+        options to pass MongoClient()
+
+    write_concern: pymongo.write_concern.WriteConcern (default: None)
+        write concern of the collection
+
+    read_preference: pymongo.read_preferences (default: None)
+        read preference of the collection
+
+    Returns
+    -------
+    MongoBackend or SQLiteBackend
+    """
+    if uri is not None and uri.startswith(SQLiteBackend.URI_PREFIX):
+        path = uri[len(SQLiteBackend.URI_PREFIX):]
+        return SQLiteBackend(path, collection_name)
+    return MongoBackend(uri, database_name, collection_name,
+                        client_options=client_options,
+                        write_concern=write_concern,
+                        read_preference=read_preference)
+
+
+class MongoBackend(object):
+    """MongoDB backend of SubsMaterialsDatabase
+
+    The client is shared in the process by get_client().
+    client, db and collection are made again after fork().
+    """
+
+    def __init__(self, uri=None, database_name='elem_subst_database',
+                 collection_name='material_collection', client_options=None,
+                 write_concern=None, read_preference=None):
+        self.uri = uri
+        if client_options is None:
+            client_options = {}
+        self.client_options = client_options
+        self.write_concern = write_concern
+        self.read_preference = read_preference
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self.key = ("mongo", uri, database_name, collection_name)
+        self.__pid = None
+
+    def __connect(self):
+        """get client, db and collection for this process
+        """
+        pid = os.getpid()
+        if self.__pid != pid:
+            self.__client = get_client(self.uri, **self.client_options)
+            self.__db = self.__client[self.database_name]
+            self.__collection = self.__db.get_collection(
+                self.collection_name, write_concern=self.write_concern,
+                read_preference=self.read_preference)
+            self.__pid = pid
+
+    @property
+    def client(self):
+        """MongoClient shared in the process
+        """
+        self.__connect()
+        return self.__client
+
+    @property
+    def db(self):
+        """database
+        """
+        self.__connect()
+        return self.__db
+
+    @property
+    def collection(self):
+        """collection
+        """
+        self.__connect()
+        return self.__collection
+
+    def create_indexes(self, indexes):
+        """create indexes if they don't exist
+
+        Parameters
+        ----------
+        indexes: a list of (name, keys)
+            keys is a list of (field, direction)
+
+        Returns
+        -------
+        a list of index names
+        """
+        models = [IndexModel(keys, name=name) for name, keys in indexes]
+        return self.collection.create_indexes(models)
+
+    def group_count(self, keys, query=None, unwind=None):
+        """count documents grouped by keys in one aggregation
+
+        Parameters
+        ----------
+        keys: a list of string
+            fields to group by
+
+        query: dict (default: None)
+            filter, all if None
+
+        unwind: string (default: None)
+            a list field in keys to count by its elements
+
+        Returns
+        -------
+        dict: {tuple of values of keys: the number of documents}
+        """
+        pipeline = []
+        if query:
+            pipeline.append({"$match": query})
+        if unwind is not None:
+            pipeline.append({"$unwind": "$" + unwind})
+        pipeline.append({"$project": {k: 1 for k in keys}})
+        pipeline.append({"$group": {"_id": {k: "$" + k for k in keys},
+                                    "n": {"$sum": 1}}})
+        result = {}
+        for x in self.collection.aggregate(pipeline, allowDiskUse=True):
+            result[tuple(x["_id"].get(k) for k in keys)] = x["n"]
+        return result
+
+    def index_usage(self):
+        """report usage of the indexes by $indexStats
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        a list of [index name, the number of operations, since]
+        """
+        result = []
+        for x in self.collection.aggregate([{"$indexStats": {}}]):
+            result.append([x["name"], x["accesses"]["ops"],
+                           x["accesses"]["since"]])
+        return result
+
+
+class SQLiteBackend(object):
+    """embedded SQLite backend of SubsMaterialsDatabase
+
+    No server process is necessary.
+    Documents are stored as JSON in a table, see SQLiteCollection.
+    A connection is made for each process.
+    """
+
+    URI_PREFIX = "sqlite:///"
+
+    def __init__(self, path, collection_name='material_collection',
+                 multikey_fields=("elements", "species"), timeout=60.0):
+        """initialize SQLiteBackend
+
+        Parameters
+        ----------
+        path: string
+            database file name
+
+        collection_name: string
+            table name
+
+        multikey_fields: a list of string
+            fields which have a list as their value
+
+        timeout: float
+            seconds to wait for a lock by another process
+        """
+        self.path = path
+        self.collection_name = collection_name
+        self.multikey_fields = list(multikey_fields)
+        self.timeout = timeout
+        self.key = ("sqlite", os.path.abspath(path), collection_name)
+        self.__pid = None
+
+    def __connect(self):
+        """get connection and collection for this process
+        """
+        pid = os.getpid()
+        if self.__pid != pid:
+            self.__connection = sqlite3.connect(self.path,
+                                                timeout=self.timeout,
+                                                isolation_level=None)
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__collection = SQLiteCollection(self.__connection,
+                                                 self.collection_name,
+                                                 self.multikey_fields)
+            self.__pid = pid
+
+    @property
+    def client(self):
+        """sqlite3 connection
+        """
+        self.__connect()
+        return self.__connection
+
+    @property
+    def db(self):
+        """sqlite3 connection
+        """
+        self.__connect()
+        return self.__connection
+
+    @property
+    def collection(self):
+        """SQLiteCollection
+        """
+        self.__connect()
+        return self.__collection
+
+    def create_indexes(self, indexes):
+        """create indexes if they don't exist
+
+        Parameters
+        ----------
+        indexes: a list of (name, keys)
+            keys is a list of (field, direction)
+
+        Returns
+        -------
+        a list of index names
+        """
+        return [self.collection.create_index(keys, name=name)
+                for name, keys in indexes]
+
+    def group_count(self, keys, query=None, unwind=None):
+        """count documents grouped by keys
+
+        See SQLiteCollection.group_count().
+        """
+        return self.collection.group_count(keys, query=query, unwind=unwind)
+
+    def index_usage(self):
+        """report the indexes
+
+        SQLite doesn't count usage of indexes.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        a list of [index name, None, None]
+        """
+        prefix = self.collection_name + "_"
+        result = []
+        for name in self.collection.index_information():
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+            result.append([name, None, None])
+        return result
+
+
+def _get_field(doc, key):
+    """get a field of doc by a dotted key
+
+    Parameters
+    ----------
+    doc: dict
+        document
+
+    key: string
+        field name, e.g., "a" or "a.b"
+
+    Returns
+    -------
+    (boolean, value): (True, value) if exists, (False, None) otherwise
+    """
+    value = doc
+    for x in key.split("."):
+        if isinstance(value, dict) and x in value:
+            value = value[x]
+        else:
+            return False, None
+    return True, value
+
+
+def _equal(a, b):
+    """compare values distinguishing booleans from numbers
+    """
+    if isinstance(a, bool) != isinstance(b, bool):
+        return False
+    return a == b
+
+
+def _match_value(exists, value, cond):
+    """match a field value with an equality condition
+
+    A list field also matches if one of its elements matches.
+    """
+    if cond is None:
+        return not exists or value is None
+    if not exists:
+        return False
+    if _equal(value, cond):
+        return True
+    if isinstance(value, list):
+        return any(_equal(x, cond) for x in value)
+    return False
+
+
+def _compare(value, op, arg):
+    """compare a value or any element of a list with arg
+    """
+    if isinstance(value, list):
+        return any(_compare(x, op, arg) for x in value)
+    if value is None or isinstance(value, bool) != isinstance(arg, bool):
+        return False
+    try:
+        if op == "$lt":
+            return value < arg
+        elif op == "$lte":
+            return value <= arg
+        elif op == "$gt":
+            return value > arg
+        else:
+            return value >= arg
+    except TypeError:
+        return False
+
+
+def _match_operator(exists, value, op, arg):
+    """match a field value with a query operator
+    """
+    if op == "$eq":
+        return _match_value(exists, value, arg)
+    elif op == "$ne":
+        return not _match_value(exists, value, arg)
+    elif op == "$in":
+        return any(_match_value(exists, value, x) for x in arg)
+    elif op == "$nin":
+        return not any(_match_value(exists, value, x) for x in arg)
+    elif op == "$all":
+        return exists and all(_match_value(exists, value, x) for x in arg)
+    elif op == "$exists":
+        return exists == bool(arg)
+    elif op in ["$lt", "$lte", "$gt", "$gte"]:
+        return exists and _compare(value, op, arg)
+    raise ValueError("unsupported operator {}".format(op))
+
+
+def _is_operator_dict(cond):
+    return (isinstance(cond, dict) and len(cond) > 0
+            and all(k.startswith("$") for k in cond))
+
+
+def _is_plain_list(value):
+    """return True if value is a list of strings, integers and such lists
+
+    Such a list is compared as JSON in SQL.
+    """
+    if not isinstance(value, list):
+        return False
+    for x in value:
+        if isinstance(x, list):
+            if not _is_plain_list(x):
+                return False
+        elif isinstance(x, bool) or not isinstance(x, (str, int)):
+            return False
+    return True
+
+
+def match_query(doc, query):
+    """match a document with a MongoDB style query
+
+    Supported are equality, $eq, $ne, $in, $nin, $all, $exists,
+    $lt, $lte, $gt, $gte, $and and $or.
+
+    Parameters
+    ----------
+    doc: dict
+        document
+
+    query: dict
+        query
+
+    Returns
+    -------
+    boolean: True if matched
+    """
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(match_query(doc, x) for x in cond):
+                return False
+        elif key == "$and":
+            if not all(match_query(doc, x) for x in cond):
+                return False
+        elif key.startswith("$"):
+            raise ValueError("unsupported operator {}".format(key))
+        else:
+            exists, value = _get_field(doc, key)
+            if _is_operator_dict(cond):
+                for op, arg in cond.items():
+                    if not _match_operator(exists, value, op, arg):
+                        return False
+            elif not _match_value(exists, value, cond):
+                return False
+    return True
+
+
+def _project(doc, projection):
+    """apply a projection of top level fields to doc
+    """
+    if projection is None:
+        return doc
+    if isinstance(projection, (list, tuple)):
+        projection = {x: 1 for x in projection}
+    include_id = bool(projection.get("_id", True))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if len(fields) > 0 and all(bool(v) for v in fields.values()):
+        result = {k: doc[k] for k in fields if k in doc}
+    else:
+        result = {k: v for k, v in doc.items()
+                  if k == "_id" or fields.get(k, 1)}
+    if include_id and "_id" in doc:
+        result["_id"] = doc["_id"]
+    elif not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def _apply_update(doc, update):
+    """apply $set and $unset of top level fields to doc
+    """
+    doc = dict(doc)
+    for op, fields in update.items():
+        if op == "$set":
+            doc.update(fields)
+        elif op == "$unset":
+            for k in fields:
+                doc.pop(k, None)
+        else:
+            raise ValueError("unsupported update operator {}".format(op))
+    return doc
+
+
+def _upsert_document(query, update=None):
+    """make a document to insert from equality fields of query
+    """
+    doc = {}
+    for k, v in query.items():
+        if not k.startswith("$") and "." not in k \
+                and not _is_operator_dict(v):
+            doc[k] = v
+    if update is not None:
+        doc = _apply_update(doc, update)
+    return doc
+
+
+class SQLiteCursor(object):
+    """cursor of SQLiteCollection.find()
+
+    Documents are read batch_size documents at a time in the order of _id,
+    so that documents changed during the iteration are read as they are.
+    """
+
+    def __init__(self, collection, query, projection=None, batch_size=1000):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self._batch_size = batch_size
+
+    def batch_size(self, batch_size):
+        """set the number of documents read at a time
+        """
+        self._batch_size = batch_size
+        return self
+
+    def __iter__(self):
+        last_id = None
+        while True:
+            rows = self.collection._select(self.query, last_id,
+                                           self._batch_size)
+            if len(rows) == 0:
+                return
+            for doc in rows:
+                last_id = doc["_id"]
+                if match_query(doc, self.query):
+                    yield _project(doc, self.projection)
+            if len(rows) < self._batch_size:
+                return
+
+
+class SQLiteCollection(object):
+    """collection on SQLite with a subset of pymongo.Collection API
+
+    A document is a row of (_id INTEGER PRIMARY KEY, doc TEXT) where doc is
+    the document in JSON.
+    An index on fields is an index on json_extract() of them.
+    Each element of the fields in multikey_fields is also saved in
+    the {name}_multikey table, which is indexed.
+
+    A query is evaluated by match_query() in python, after rows are
+    selected by SQL using equality or range conditions on indexed fields
+    and multikey fields.
+    """
+
+    def __init__(self, connection, name, multikey_fields=()):
+        self.connection = connection
+        self.name = name
+        self.multikey_fields = list(multikey_fields)
+        self.table = '"{}"'.format(name.replace('"', '""'))
+        self.multikey_table = '"{}_multikey"'.format(name.replace('"', '""'))
+        self.scalar_fields = set()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS {} "
+            "(_id INTEGER PRIMARY KEY, doc TEXT NOT NULL)".format(self.table))
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS {} "
+            "(_id INTEGER NOT NULL, field TEXT NOT NULL, value)".format(
+                self.multikey_table))
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS "{0}_multikey_value" '
+            'ON {1} (field, value, _id)'.format(
+                name.replace('"', '""'), self.multikey_table))
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS "{0}_multikey_id" '
+            'ON {1} (_id)'.format(name.replace('"', '""'),
+                                  self.multikey_table))
+        for index_name in self.index_information():
+            self.scalar_fields.update(self._index_fields(index_name))
+
+    @staticmethod
+    def _field_expression(field):
+        return "json_extract(doc, '$.{}')".format(field.replace("'", "''"))
+
+    def _index_fields(self, index_name):
+        row = self.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE type='index' AND name=?",
+            (index_name,)).fetchone()
+        fields = []
+        if row is not None and row[0] is not None:
+            for x in row[0].split("json_extract(doc, '$.")[1:]:
+                fields.append(x.split("')")[0].replace("''", "'"))
+        return fields
+
+    def create_index(self, keys, name=None):
+        """create an index on json_extract() of fields
+
+        Fields in multikey_fields are skipped
+        because they are indexed in the multikey table.
+
+        Parameters
+        ----------
+        keys: a list of (field, direction)
+            fields of the index
+
+        name: string
+            index name
+
+        Returns
+        -------
+        string: index name
+        """
+        fields = [k for k, _ in keys if k not in self.multikey_fields]
+        if name is None:
+            name = "_".join([k for k, _ in keys])
+        if len(fields) == 0:
+            return name
+        expressions = ", ".join([self._field_expression(k) for k in fields])
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS "{}" ON {} ({})'.format(
+                "{}_{}".format(self.name, name).replace('"', '""'),
+                self.table, expressions))
+        self.scalar_fields.update(fields)
+        return name
+
+    def create_indexes(self, models):
+        """create indexes by pymongo.IndexModel
+
+        Parameters
+        ----------
+        models: a list of pymongo.IndexModel
+
+        Returns
+        -------
+        a list of index names
+        """
+        names = []
+        for model in models:
+            document = model.document
+            names.append(self.create_index(list(document["key"].items()),
+                                           name=document.get("name")))
+        return names
+
+    def index_information(self):
+        """return names of the indexes on the table
+        """
+        rows = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='index' "
+            "AND tbl_name=? AND sql IS NOT NULL", (self.name,)).fetchall()
+        return [x[0] for x in rows]
+
+    def _where(self, query):
+        """make SQL conditions from top level fields of query
+
+        The conditions select a superset of the matched documents.
+        They select exactly the matched documents if every field of query
+        is a string equality, $eq, $in or $all of an indexed field
+        or a multikey field, or an equality of a multikey field with
+        a list of strings and integers, e.g., {"species": [["Fe", 2]]}.
+
+        Returns
+        -------
+        (a list of string, a list, boolean): conditions, parameters and
+            True if the conditions are exact
+        """
+        conditions = []
+        params = []
+        exact = True
+        for key, cond in query.items():
+            if key.startswith("$"):
+                exact = False
+                continue
+            if key in self.multikey_fields:
+                if _is_operator_dict(cond):
+                    values = cond.get("$all", [])
+                    if "$eq" in cond:
+                        values = values + [cond["$eq"]]
+                    if not set(cond.keys()) <= set(["$all", "$eq"]):
+                        exact = False
+                elif isinstance(cond, list) and _is_plain_list(cond):
+                    # the list itself or an element of the field
+                    conditions.append(
+                        "({} = ? OR _id IN (SELECT _id FROM {} "
+                        "WHERE field=? AND value=?))".format(
+                            self._field_expression(key), self.multikey_table))
+                    params.extend([json.dumps(cond, separators=(",", ":")),
+                                   key, json.dumps(cond)])
+                    continue
+                else:
+                    values = [cond]
+                for value in values:
+                    if isinstance(value, (str, int, float)):
+                        conditions.append(
+                            "_id IN (SELECT _id FROM {} "
+                            "WHERE field=? AND value=?)".format(
+                                self.multikey_table))
+                        params.extend([key, value])
+                    if not isinstance(value, str):
+                        # 1 also selects True in SQL
+                        exact = False
+            elif key in self.scalar_fields:
+                expression = self._field_expression(key)
+                if not _is_operator_dict(cond):
+                    cond = {"$eq": cond}
+                for op, arg in cond.items():
+                    sqlop = {"$eq": "=", "$lt": "<", "$lte": "<=",
+                             "$gt": ">", "$gte": ">="}.get(op)
+                    if sqlop is not None and isinstance(arg,
+                                                        (str, int, float)):
+                        conditions.append("{} {} ?".format(expression, sqlop))
+                        params.append(arg)
+                        if op != "$eq" or not isinstance(arg, str):
+                            exact = False
+                    elif op == "$in" and len(arg) > 0 and all(
+                            isinstance(x, (str, int, float)) for x in arg):
+                        conditions.append("{} IN ({})".format(
+                            expression, ",".join(["?"] * len(arg))))
+                        params.extend(arg)
+                        if not all(isinstance(x, str) for x in arg):
+                            exact = False
+                    else:
+                        exact = False
+            else:
+                exact = False
+        return conditions, params, exact
+
+    def _select(self, query, last_id=None, limit=None):
+        """select rows which may match query
+
+        Returns
+        -------
+        a list of documents
+        """
+        conditions, params, _ = self._where(query)
+        if last_id is not None:
+            conditions.append("_id > ?")
+            params.append(last_id)
+        sql = "SELECT _id, doc FROM {}".format(self.table)
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY _id"
+        if limit is not None:
+            sql += " LIMIT {}".format(int(limit))
+        result = []
+        for _id, text in self.connection.execute(sql, params):
+            doc = json.loads(text)
+            doc["_id"] = _id
+            result.append(doc)
+        return result
+
+    def _find_matched(self, query, limit=None):
+        result = []
+        for doc in self._select(query):
+            if match_query(doc, query):
+                result.append(doc)
+                if limit is not None and len(result) >= limit:
+                    break
+        return result
+
+    def _write_multikey(self, _id, doc):
+        self.connection.execute(
+            "DELETE FROM {} WHERE _id=?".format(self.multikey_table), (_id,))
+        rows = []
+        for field in self.multikey_fields:
+            value = doc.get(field)
+            if isinstance(value, list):
+                for x in value:
+                    if isinstance(x, (list, dict)):
+                        x = json.dumps(x)
+                    rows.append((_id, field, x))
+        if len(rows) > 0:
+            self.connection.executemany(
+                "INSERT INTO {} (_id, field, value) VALUES (?, ?, ?)".format(
+                    self.multikey_table), rows)
+
+    def _insert(self, doc):
+        body = {k: v for k, v in doc.items() if k != "_id"}
+        if "_id" in doc:
+            cur = self.connection.execute(
+                "INSERT INTO {} (_id, doc) VALUES (?, ?)".format(self.table),
+                (doc["_id"], json.dumps(body)))
+        else:
+            cur = self.connection.execute(
+                "INSERT INTO {} (doc) VALUES (?)".format(self.table),
+                (json.dumps(body),))
+        _id = cur.lastrowid
+        doc["_id"] = _id
+        self._write_multikey(_id, doc)
+        return _id
+
+    def _replace(self, _id, doc):
+        body = {k: v for k, v in doc.items() if k != "_id"}
+        self.connection.execute(
+            "UPDATE {} SET doc=? WHERE _id=?".format(self.table),
+            (json.dumps(body), _id))
+        self._write_multikey(_id, doc)
+
+    def _delete(self, _id):
+        self.connection.execute(
+            "DELETE FROM {} WHERE _id=?".format(self.table), (_id,))
+        self.connection.execute(
+            "DELETE FROM {} WHERE _id=?".format(self.multikey_table), (_id,))
+
+    class _Transaction(object):
+        """BEGIN IMMEDIATE ... COMMIT or ROLLBACK
+        """
+
+        def __init__(self, connection):
+            self.connection = connection
+
+        def __enter__(self):
+            self.connection.execute("BEGIN IMMEDIATE")
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            if exc_type is None:
+                self.connection.execute("COMMIT")
+            else:
+                self.connection.execute("ROLLBACK")
+            return False
+
+    def _transaction(self):
+        return self._Transaction(self.connection)
+
+    def insert_one(self, doc):
+        """the same as pymongo insert_one()
+        """
+        with self._transaction():
+            _id = self._insert(doc)
+        return InsertOneResult(_id, True)
+
+    def insert_many(self, docs, ordered=True):
+        """the same as pymongo insert_many()
+        """
+        requests = [("insert", doc) for doc in docs]
+        result = self._bulk(requests, ordered)
+        return InsertManyResult(result["inserted_ids"], True)
+
+    def find(self, filter=None, projection=None, batch_size=1000):
+        """the same as pymongo find()
+
+        Returns
+        -------
+        SQLiteCursor
+        """
+        if filter is None:
+            filter = {}
+        return SQLiteCursor(self, filter, projection, batch_size)
+
+    def find_one(self, filter=None, projection=None):
+        """the same as pymongo find_one()
+        """
+        if filter is None:
+            filter = {}
+        docs = self._find_matched(filter, limit=1)
+        if len(docs) == 0:
+            return None
+        return _project(docs[0], projection)
+
+    def count_documents(self, filter):
+        """the same as pymongo count_documents()
+
+        It is a SELECT COUNT(*) if the conditions of _where() are exact.
+        """
+        conditions, params, exact = self._where(filter)
+        if not exact:
+            return sum(1 for doc in self._select(filter)
+                       if match_query(doc, filter))
+        sql = "SELECT COUNT(*) FROM {}".format(self.table)
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self.connection.execute(sql, params).fetchone()[0]
+
+    def group_count(self, keys, query=None, unwind=None):
+        """count documents grouped by keys
+
+        It is a GROUP BY of json_extract() of keys.
+        The elements of unwind are read from the multikey table
+        if unwind is in multikey_fields.
+
+        Parameters
+        ----------
+        keys: a list of string
+            fields to group by
+
+        query: dict (default: None)
+            filter, all if None
+
+        unwind: string (default: None)
+            a list field in keys to count by its elements
+
+        Returns
+        -------
+        dict: {tuple of values of keys: the number of documents}
+        """
+        result = {}
+        if query or (unwind is not None
+                     and unwind not in self.multikey_fields):
+            for doc in self.find(query, keys):
+                values = [doc.get(k) for k in keys]
+                if unwind is None:
+                    combinations = [values]
+                else:
+                    i = keys.index(unwind)
+                    combinations = [values[:i] + [x] + values[i+1:]
+                                    for x in (doc.get(unwind) or [])]
+                for x in combinations:
+                    key = tuple(x)
+                    result[key] = result.get(key, 0) + 1
+            return result
+
+        expressions = []
+        for k in keys:
+            if k == unwind:
+                expressions.append("m.value")
+            else:
+                expressions.append("json_extract(t.doc, '$.{}')".format(
+                    k.replace("'", "''")))
+        sql = "SELECT {0}, COUNT(*) FROM {1} AS t".format(
+            ", ".join(expressions), self.table)
+        params = []
+        if unwind is not None:
+            sql += " JOIN {} AS m ON m._id = t._id AND m.field = ?".format(
+                self.multikey_table)
+            params.append(unwind)
+        sql += " GROUP BY {}".format(", ".join(expressions))
+        for row in self.connection.execute(sql, params):
+            result[tuple(row[:-1])] = row[-1]
+        return result
+
+    def delete_one(self, filter):
+        """the same as pymongo delete_one()
+        """
+        with self._transaction():
+            n = self._delete_matched(filter, many=False)
+        return DeleteResult({"n": n}, True)
+
+    def delete_many(self, filter):
+        """the same as pymongo delete_many()
+        """
+        with self._transaction():
+            n = self._delete_matched(filter, many=True)
+        return DeleteResult({"n": n}, True)
+
+    def replace_one(self, filter, replacement, upsert=False):
+        """the same as pymongo replace_one()
+        """
+        with self._transaction():
+            raw = self._update_matched(filter, replacement, upsert,
+                                       many=False, replace=True)
+        return UpdateResult(raw, True)
+
+    def update_one(self, filter, update, upsert=False):
+        """the same as pymongo update_one() with $set and $unset
+        """
+        with self._transaction():
+            raw = self._update_matched(filter, update, upsert, many=False)
+        return UpdateResult(raw, True)
+
+    def update_many(self, filter, update, upsert=False):
+        """the same as pymongo update_many() with $set and $unset
+        """
+        with self._transaction():
+            raw = self._update_matched(filter, update, upsert, many=True)
+        return UpdateResult(raw, True)
+
+    def find_one_and_update(self, filter, update, projection=None,
+                            return_document=False, upsert=False):
+        """the same as pymongo find_one_and_update() with $set and $unset
+
+        The document is found and updated in a transaction,
+        so that only one process can update the same document.
+        """
+        with self._transaction():
+            docs = self._find_matched(filter, limit=1)
+            if len(docs) == 0:
+                if not upsert:
+                    return None
+                doc = _upsert_document(filter, update)
+                self._insert(doc)
+                return _project(doc, projection) if return_document else None
+            before = docs[0]
+            after = _apply_update(before, update)
+            self._replace(before["_id"], after)
+        if return_document:
+            return _project(after, projection)
+        return _project(before, projection)
+
+    def _delete_matched(self, filter, many):
+        docs = self._find_matched(filter, limit=None if many else 1)
+        for doc in docs:
+            self._delete(doc["_id"])
+        return len(docs)
+
+    def _update_matched(self, filter, update, upsert, many, replace=False):
+        docs = self._find_matched(filter, limit=None if many else 1)
+        raw = {"n": len(docs), "nModified": 0}
+        for doc in docs:
+            if replace:
+                new = dict(update)
+                new["_id"] = doc["_id"]
+            else:
+                new = _apply_update(doc, update)
+            if new != doc:
+                self._replace(doc["_id"], new)
+                raw["nModified"] += 1
+        if len(docs) == 0 and upsert:
+            if replace:
+                new = dict(update)
+            else:
+                new = _upsert_document(filter, update)
+            raw["upserted"] = self._insert(new)
+            raw["n"] = 1
+        return raw
+
+    def _bulk(self, requests, ordered):
+        """execute requests in a transaction
+
+        Parameters
+        ----------
+        requests: a list of (operation, arguments...)
+
+        Returns
+        -------
+        dict: bulk_api_result and inserted_ids
+        """
+        result = {"writeErrors": [], "writeConcernErrors": [],
+                  "nInserted": 0, "nUpserted": 0, "nMatched": 0,
+                  "nModified": 0, "nRemoved": 0, "upserted": [],
+                  "inserted_ids": []}
+        with self._transaction():
+            for i, request in enumerate(requests):
+                op = request[0]
+                try:
+                    if op == "insert":
+                        result["inserted_ids"].append(
+                            self._insert(request[1]))
+                        result["nInserted"] += 1
+                    elif op in ["replace", "update_one", "update_many"]:
+                        raw = self._update_matched(
+                            request[1], request[2], request[3],
+                            many=(op == "update_many"),
+                            replace=(op == "replace"))
+                        if "upserted" in raw:
+                            result["nUpserted"] += 1
+                            result["upserted"].append(
+                                {"index": i, "_id": raw["upserted"]})
+                        else:
+                            result["nMatched"] += raw["n"]
+                            result["nModified"] += raw["nModified"]
+                    elif op in ["delete_one", "delete_many"]:
+                        result["nRemoved"] += self._delete_matched(
+                            request[1], many=(op == "delete_many"))
+                    else:
+                        raise ValueError("unsupported operation {}".format(op))
+                except (ValueError, TypeError, sqlite3.Error) as e:
+                    result["writeErrors"].append({"index": i,
+                                                  "errmsg": repr(e),
+                                                  "op": request[1]})
+                    if ordered:
+                        break
+        if len(result["writeErrors"]) > 0:
+            raise BulkWriteError(result)
+        return result
+
+    def bulk_write(self, requests, ordered=True):
+        """the same as pymongo bulk_write()
+
+        requests are InsertOne, ReplaceOne, UpdateOne, UpdateMany,
+        DeleteOne and DeleteMany of this module,
+        which are also accepted by pymongo.
+        """
+        converted = []
+        for request in requests:
+            operation = getattr(request, "operation", None)
+            if operation is None:
+                raise ValueError("unsupported request {}, use the requests "
+                                 "of subsMat.backend".format(
+                                     type(request).__name__))
+            converted.append(operation)
+        result = self._bulk(converted, ordered)
+        result.pop("inserted_ids")
+        return BulkWriteResult(result, True)
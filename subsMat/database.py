@@ -1,12 +1,79 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import copy
 import glob
+import inspect
 import os
+import socket
+import time
+import uuid as uuid_module
 from pathlib import Path
+from typing import Any, NamedTuple, Optional
 
-from pymongo import MongoClient
+from pymatgen.core.composition import Composition
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from .backend import (DeleteMany, InsertOne, ReplaceOne,  # noqa: F401
+                      UpdateOne, get_client, make_backend)
+from .misc import composition_key
+from .scanner import DirScanner, iter_dirs, match_dir
+
+
+def default_worker_id():
+    """make id of this process as a worker
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    string: "hostname:pid"
+    """
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+# {class: True if it accepts lazy}
+_accepts_lazy = {}
+
+
+def make_lazy_node(wrapperclass, dirname):
+    """make wrapperclass(dirname, lazy=True) if it accepts lazy
+
+    A wrapper class without the lazy keyword is called as
+    wrapperclass(dirname) as before.
+    The signature of a class is checked once, and the others,
+    e.g. functools.partial unpickled in every task of a worker, every call.
+
+    Parameters
+    ----------
+    wrapperclass: class
+        a class to access the node
+
+    dirname: string
+        directory name
+
+    Returns
+    -------
+    an instance of wrapperclass
+    """
+    accepts = None
+    if isinstance(wrapperclass, type):
+        accepts = _accepts_lazy.get(wrapperclass)
+    if accepts is None:
+        try:
+            parameters = inspect.signature(wrapperclass).parameters
+            accepts = "lazy" in parameters or any(
+                x.kind == inspect.Parameter.VAR_KEYWORD
+                for x in parameters.values())
+        except (TypeError, ValueError):
+            accepts = False
+        if isinstance(wrapperclass, type):
+            _accepts_lazy[wrapperclass] = accepts
+    if accepts:
+        return wrapperclass(dirname, lazy=True)
+    return wrapperclass(dirname)
 
 
 class elementListExpansion(object):
@@ -59,7 +126,7 @@ class elementListExpansion(object):
         -------
         a dic of existence or not of all elements
         """
-        element_dic = copy.deepcopy(self.element_dic)
+        element_dic = dict(self.element_dic)
         for elm in species:
             elm_name = elm[0]
             if elm_name in element_dic:
@@ -69,46 +136,330 @@ class elementListExpansion(object):
                       "but continue.".format(elm_name))
         return element_dic
 
+    def compact(self, species):
+        """make a compact list of elements in species
+
+        The elements are in the order of self.element_list,
+        so that the same set of elements gives the same list.
+
+        Parameters
+        ----------
+        species: specie list
+            a list of [specie,#_of_specie]
+
+        Returns
+        -------
+        a list of element names, e.g., ["Fe", "Yb"]
+        """
+        present = set()
+        for elm in species:
+            elm_name = elm[0]
+            if elm_name in self.element_dic:
+                present.add(elm_name)
+            else:
+                print("unknown element name {}, "
+                      "but continue.".format(elm_name))
+        return [x for x in self.element_list if x in present]
+
+
+_element_list_expansion = elementListExpansion()
+
+
+class MaterialRecord(NamedTuple):
+    """lightweight record of a document
+
+    It has only the fields the workflow uses.
+    """
+    id: Any
+    uuid: Optional[str]
+    basedir: Optional[str]
+    positionfile: Optional[str]
+    purpose: Optional[str]
+    achievement: Optional[str]
+
+    # fields to read from the collection
+    FIELDS = ["uuid", "basedir", "positionfile", "purpose", "achievement"]
+
+    @classmethod
+    def from_document(cls, doc):
+        """make MaterialRecord from a document
+
+        Parameters
+        ----------
+        doc: dict
+            document
+
+        Returns
+        -------
+        MaterialRecord
+        """
+        return cls(doc.get("_id"), doc.get("uuid"), doc.get("basedir"),
+                   doc.get("positionfile"), doc.get("purpose"),
+                   doc.get("achievement"))
+
 
 class SubsMaterialsDatabase(object):
     """database access library
 
     You can use .collection to access the DB directly.
 
+    The indexes in INDEXES are created when the collection is used
+    for the first time in the process.
+
+    Existence of elements is saved in one of element_encoding,
+
+    * "array": a list of elements in the "elements" field,
+      e.g., {"elements": ["Fe", "Yb"]}, with a multikey index.
+    * "columns": a boolean field for each element,
+      e.g., {"H": False, ..., "Fe": True, ...}.
+      This is the old format.
+
+    Use migrate_element_encoding() to convert an existing collection.
+
     """
 
+    # (name, keys) of the indexes of the collection
+    # achievement_purpose: filters by state, {"achievement"} and
+    #                      {"purpose", "achievement"}, find_subs_elems()
+    # uuid: a node by uuid
+    # basedir: a node by basedir, sync_with_dirs(), update_files_under()
+    # elements_achievement: find_subs_elems() with element_encoding="array",
+    #                       not made with "columns"
+    # fingerprint: find_fingerprint() to prefilter StructureMatcher
+    # composition: find_by_composition()
+    INDEXES = [
+        ("achievement_purpose", [("achievement", ASCENDING),
+                                 ("purpose", ASCENDING)]),
+        ("uuid", [("uuid", ASCENDING)]),
+        ("basedir", [("basedir", ASCENDING)]),
+        ("elements_achievement", [("elements", ASCENDING),
+                                  ("achievement", ASCENDING)]),
+        ("fingerprint", [("fingerprint.key", ASCENDING)]),
+        ("composition", [("composition.hash", ASCENDING)]),
+    ]
+
+    ELEMENT_ENCODINGS = ["array", "columns"]
+
+    # (backend key, element_encoding) whose indexes are already ensured
+    _indexed_collections = set()
+
     def __init__(self, database_name='elem_subst_database',
-                 collection_name='material_collection'):
-        self.client = MongoClient()
+                 collection_name='material_collection',
+                 create_indexes=True, element_encoding="array",
+                 uri=None, client_options=None,
+                 write_concern=None, read_preference=None, backend=None):
+        """initialize SubsMaterialsDatabase
+
+        The MongoClient is shared by the instances with the same uri and
+        client_options (see get_client()), so that making an instance is
+        cheap.
+
+        Parameters
+        ----------
+        database_name: string
+            database name
+
+        collection_name: string
+            collection name
+
+        create_indexes: boolean
+            call ensure_indexes() once in the process
+
+        element_encoding: string
+            "array" or "columns"
+
+        uri: string (default: None)
+            MongoDB URI, or "sqlite:///path/to/file" to use SQLiteBackend.
+            The environment variable SUBSMAT_DATABASE_URI is used if None,
+            and localhost if it isn't set.
+
+        client_options: dict (default: None)
+            options to pass MongoClient(),
+            e.g., {"maxPoolSize": 10, "serverSelectionTimeoutMS": 5000}
+
+        write_concern: pymongo.write_concern.WriteConcern (default: None)
+            write concern of the collection
+
+        read_preference: pymongo.read_preferences (default: None)
+            read preference of the collection
+
+        backend: MongoBackend or SQLiteBackend (default: None)
+            backend to use instead of one made from uri
+        """
+        if element_encoding not in self.ELEMENT_ENCODINGS:
+            raise ValueError("unknown element_encoding {}".format(
+                element_encoding))
+        self.element_encoding = element_encoding
+        if backend is None:
+            if uri is None:
+                uri = os.environ.get("SUBSMAT_DATABASE_URI")
+            backend = make_backend(uri, database_name, collection_name,
+                                   client_options=client_options,
+                                   write_concern=write_concern,
+                                   read_preference=read_preference)
+        self.backend = backend
         self.database_name = database_name
         self.collection_name = collection_name
-        self.db = self.client[database_name]
-        self.collection = self.db[collection_name]
+        self.element_expansion = _element_list_expansion
+        self.ingest_report = None
+        if create_indexes:
+            key = (backend.key, element_encoding)
+            if key not in SubsMaterialsDatabase._indexed_collections:
+                self.ensure_indexes()
+                SubsMaterialsDatabase._indexed_collections.add(key)
+
+    @property
+    def client(self):
+        """client of the backend
+        """
+        return self.backend.client
+
+    @property
+    def db(self):
+        """database of the backend
+        """
+        return self.backend.db
+
+    @property
+    def collection(self):
+        """collection of the backend
+        """
+        return self.backend.collection
+
+    def ensure_indexes(self):
+        """create the indexes in self.INDEXES if they don't exist
+
+        It does nothing for the existing indexes.
+        The index of the "elements" field is made only if
+        element_encoding is "array".
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        a list of index names
+        """
+        indexes = self.INDEXES
+        if self.element_encoding != "array":
+            indexes = [x for x in indexes if x[0] != "elements_achievement"]
+        return self.backend.create_indexes(indexes)
+
+    def index_usage(self):
+        """report usage of the indexes
+
+        It uses the $indexStats aggregation for MongoDB.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        a list of [index name, the number of operations, since]
+        """
+        return self.backend.index_usage()
+
+    def status_summary(self, by=None, query=None):
+        """count documents of each state in one aggregation
+
+        Parameters
+        ----------
+        by: string (default: None)
+            break counts down by "nspecies" or "element" too.
+            "element" needs element_encoding="array".
+
+        query: dict (default: None)
+            filter, all if None
+
+        Returns
+        -------
+        dict: {(purpose, achievement): the number of documents}
+            or {(purpose, achievement, nspecies or element): the number}
+        """
+        # the same order as the achievement_purpose index
+        keys = ["achievement", "purpose"]
+        unwind = None
+        if by == "nspecies":
+            keys.append("nspecies")
+        elif by == "element":
+            if self.element_encoding != "array":
+                raise ValueError("by=\"element\" needs "
+                                 "element_encoding=\"array\"")
+            keys.append("elements")
+            unwind = "elements"
+        elif by is not None:
+            raise ValueError("unknown by {}".format(by))
+        counts = self.backend.group_count(keys, query=query, unwind=unwind)
+        return {(k[1], k[0]) + k[2:]: v for k, v in counts.items()}
 
     def collection_remove(self, query=None):
         """remove collection
 
-        the same as collection.remove()
+        the same as collection.delete_many()
+        (collection.remove() doesn't exist in pymongo 4 and SQLiteBackend)
 
         Parameters
         ----------
-        query: string
-            query to pass collection.remove()
+        query: dict
+            query to pass collection.delete_many(), all if None
 
         Returns
         -------
-        retrun status of collection.remove()
+        retrun status of collection.delete_many()
         """
         if query is None:
-            ret = self.collection.remove()
+            query = {}
+        return self.collection.delete_many(query)
+
+    def make_document(self, doc, element_expansion=True):
+        """make a document to insert into the collection
+
+        The composition key is also added.
+        doc itself is not changed.
+        A shallow copy is enough because only top level keys are added.
+
+        Parameters
+        ----------
+        doc: document
+            document made by wrapperclass.as_dict()
+
+        element_expansion: boolean
+            add element fields to DB
+
+        Returns
+        -------
+        dict: document to insert
+        """
+        doc = dict(doc)
+        if element_expansion:
+            doc.update(self.element_fields(doc["species"]))
+        if "species" in doc:
+            doc.update({"composition": composition_key(doc["species"])})
+        return doc
+
+    def element_fields(self, species):
+        """make element fields according to self.element_encoding
+
+        Parameters
+        ----------
+        species: specie list
+            a list of [specie,#_of_specie]
+
+        Returns
+        -------
+        dict: fields to add to the document
+        """
+        if self.element_encoding == "array":
+            return {"elements": self.element_expansion.compact(species)}
         else:
-            ret = self.collection.remove(query)
-        return ret
+            return self.element_expansion.expansion(species)
 
     def insert_one(self, doc, element_expansion=True):
         """insert doc
 
-        also add element columns using elementListExpansion class
+        also add element fields using elementListExpansion class
 
         Parameters
         ----------
@@ -116,19 +467,40 @@ class SubsMaterialsDatabase(object):
             document to insert by insert_one()
 
         element_expansion: boolean
-            add all element columns to DB
+            add element fields to DB
 
         Returns
         -------
         collection.insert_one(doc)
         """
-        doc = copy.deepcopy(doc)
-        if element_expansion:
-            species_longcolumns = doc["species"]
-            elm_long = elementListExpansion().expansion(species_longcolumns)
-            doc.update(elm_long)
+        doc = self.make_document(doc, element_expansion)
         return self.collection.insert_one(doc)
 
+    def insert_many(self, docs, element_expansion=True, ordered=False):
+        """insert docs at once
+
+        also add element fields using elementListExpansion class.
+        The default is an unordered bulk insert, so that a failed document
+        doesn't stop insertion of the others.
+
+        Parameters
+        ----------
+        docs: a list of documents
+            documents to insert by insert_many()
+
+        element_expansion: boolean
+            add element fields to DB
+
+        ordered: boolean
+            passed to collection.insert_many()
+
+        Returns
+        -------
+        collection.insert_many(docs)
+        """
+        docs = [self.make_document(doc, element_expansion) for doc in docs]
+        return self.collection.insert_many(docs, ordered=ordered)
+
     def delete_one(self, filterstring):
         """delete DB by filter
 
@@ -148,7 +520,7 @@ class SubsMaterialsDatabase(object):
     def subs_elem_query_sentence(self, subs_elm):
         """make query from sub_elm
 
-        It uses element columns.
+        It uses element fields of self.element_encoding.
 
         Parameters
         ----------
@@ -158,13 +530,88 @@ class SubsMaterialsDatabase(object):
         Returns
         -------
         query dic
-            {"Fe": True, "Gd": True}
+            {"elements": {"$all": ["Fe", "Gd"]}} for "array"
+            {"Fe": True, "Gd": True} for "columns"
         """
+        if self.element_encoding == "array":
+            elements = []
+            for x in subs_elm:
+                if x[0] not in elements:
+                    elements.append(x[0])
+            return {"elements": {"$all": elements}}
         query_elm_dic = {}
         for x in subs_elm:
             query_elm_dic.update({x[0]: True})
         return query_elm_dic
 
+    def migrate_element_encoding(self, batch_size=1000):
+        """convert element fields of all the documents
+        to self.element_encoding
+
+        The element fields are made from "species" of each document,
+        and the fields of the other encoding are removed.
+
+        Parameters
+        ----------
+        batch_size: int
+            the number of documents in a bulk write
+
+        Returns
+        -------
+        int: the number of converted documents
+        """
+        element_list = self.element_expansion.element_list
+        if self.element_encoding == "array":
+            unset = {x: "" for x in element_list}
+        else:
+            unset = {"elements": ""}
+
+        n = 0
+        requests = []
+        for doc in self.collection.find({"species": {"$exists": True}},
+                                        {"species": 1}):
+            fields = self.element_fields(doc["species"])
+            requests.append(UpdateOne({"_id": doc["_id"]},
+                                      {"$set": fields, "$unset": unset}))
+            if len(requests) >= batch_size:
+                n += self.collection.bulk_write(requests,
+                                                ordered=False).modified_count
+                requests = []
+        if len(requests) > 0:
+            n += self.collection.bulk_write(requests,
+                                            ordered=False).modified_count
+        return n
+
+    def add_composition_keys(self, batch_size=1000):
+        """add the composition key to all the documents
+
+        The key is made from "species" of each document.
+
+        Parameters
+        ----------
+        batch_size: int
+            the number of documents in a bulk write
+
+        Returns
+        -------
+        int: the number of changed documents
+        """
+        n = 0
+        requests = []
+        for doc in self.collection.find({"species": {"$exists": True}},
+                                        {"species": 1}):
+            composition = composition_key(doc["species"])
+            requests.append(UpdateOne({"_id": doc["_id"]},
+                                      {"$set": {"composition": composition}}))
+            if len(requests) >= batch_size:
+                n += self.collection.bulk_write(requests,
+                                                ordered=False).modified_count
+                requests = []
+        if len(requests) > 0:
+            n += self.collection.bulk_write(requests,
+                                            ordered=False).modified_count
+        return n
+
     def count_documents(self, query=None):
         """count_documents by collection.count_documents(query)
 
@@ -181,17 +628,40 @@ class SubsMaterialsDatabase(object):
             query = {}
         return self.collection.count_documents(query)
 
-    def find(self, query):
+    def find(self, query, projection=None, batch_size=None,
+             as_record=False):
         """find with query by collection.find(query)
 
 
         Parameters
         ----------
         query: query sentence for find()
+
+        projection: dict or list (default: None)
+            fields to return, e.g., ["basedir", "uuid"], all if None
+
+        batch_size: int (default: None)
+            the number of documents the cursor gets at a time
+
+        as_record: boolean
+            return MaterialRecord instead of dict.
+            Only the fields of MaterialRecord are read if projection is None.
+
+        Returns
+        -------
+        collection.find() result, or a generator of MaterialRecord
         """
-        return self.collection.find(query)
+        if as_record and projection is None:
+            projection = MaterialRecord.FIELDS
+        cursor = self.collection.find(query, projection)
+        if batch_size is not None:
+            cursor = cursor.batch_size(batch_size)
+        if as_record:
+            return (MaterialRecord.from_document(doc) for doc in cursor)
+        return cursor
 
-    def find_subs_elems(self, subs_elm):
+    def find_subs_elems(self, subs_elm, projection=None, batch_size=None,
+                        as_record=False):
         """find with materials by subs_elm
 
         It uses self.subs_elem_query_sentence(subs_elm).
@@ -200,13 +670,157 @@ class SubsMaterialsDatabase(object):
         ----------
         subs_elm: a list of elements to substitiute
 
+        projection, batch_size, as_record:
+            see self.find()
+
         Returns
         -------
-        collection.find() result
+        collection.find() result, or a generator of MaterialRecord
         """
         query_sentence = self.subs_elem_query_sentence(subs_elm)
         query_sentence.update({"achievement": "completed"})
-        return self.find(query_sentence)
+        return self.find(query_sentence, projection=projection,
+                         batch_size=batch_size, as_record=as_record)
+
+    def find_fingerprint(self, fingerprint, projection=None, batch_size=None,
+                         as_record=False):
+        """find materials with the same fingerprint
+
+        Only they can match by StructureMatcher().fit().
+
+        Parameters
+        ----------
+        fingerprint: dict or string
+            SubsStructure.fingerprint() or its "key"
+
+        projection, batch_size, as_record:
+            see self.find()
+
+        Returns
+        -------
+        collection.find() result, or a generator of MaterialRecord
+        """
+        if isinstance(fingerprint, dict):
+            fingerprint = fingerprint["key"]
+        return self.find({"fingerprint.key": fingerprint},
+                         projection=projection, batch_size=batch_size,
+                         as_record=as_record)
+
+    def find_by_composition(self, composition, projection=None,
+                            batch_size=None, as_record=False):
+        """find materials with the same composition
+
+        The order of species doesn't matter.
+
+        Parameters
+        ----------
+        composition: a list of [string, int], string or Composition
+            species, e.g., [["Yb", 1], ["Au", 4]], formula, e.g., "YbAu4",
+            or pymatgen Composition
+
+        projection, batch_size, as_record:
+            see self.find()
+
+        Returns
+        -------
+        collection.find() result, or a generator of MaterialRecord
+
+        Raises
+        ------
+        ValueError if the number of an element isn't an integer
+        """
+        if not isinstance(composition, (str, Composition)):
+            composition = Composition({x: n for x, n in composition})
+        reduced, factor = Composition(
+            composition).get_reduced_composition_and_factor()
+        species = []
+        for x, n in reduced.items():
+            # the amounts are left as they are unless they are integers
+            if abs(n - round(n)) > 1e-8:
+                raise ValueError("the number of {} isn't an integer "
+                                 "in {}".format(x, composition))
+            species.append([str(x), int(round(n)) * int(factor)])
+        key = composition_key(species)
+        return self.find({"composition.hash": key["hash"],
+                          "composition.reduced_formula":
+                          key["reduced_formula"]},
+                         projection=projection, batch_size=batch_size,
+                         as_record=as_record)
+
+    def add_fingerprints(self, wrapperclass, query=None, batch_size=1000):
+        """add fingerprints to the materials which don't have it
+
+        The fingerprint is saved in the metadata file of the current
+        directory and in the document.
+        An older fingerprint without "natoms", whose key is only
+        the reduced formula, is also made again,
+        so that all the keys can be compared.
+
+        Parameters
+        ----------
+        wrapperclass: class
+            a class to access the node
+            must has .load_structure(), .update_currentdir_metadata()
+            and .read_mtime()
+
+        query: dict (default: None)
+            filter of the materials, all if None
+
+        batch_size: int
+            the number of documents in a bulk write
+
+        Returns
+        -------
+        int: the number of materials changed
+        """
+        missing = {"$or": [{"fingerprint": {"$exists": False}},
+                           {"fingerprint.natoms": {"$exists": False}}]}
+        if query is None:
+            query = missing
+        else:
+            query = {"$and": [query, missing]}
+        n = 0
+        requests = []
+        for doc in self.collection.find(query, {"basedir": 1}):
+            node = make_lazy_node(wrapperclass, doc["basedir"])
+            fingerprint = node.load_structure().fingerprint()
+            node.update_currentdir_metadata({"fingerprint": fingerprint})
+            # so that sync_with_dirs() doesn't see it changed
+            requests.append(UpdateOne({"_id": doc["_id"]},
+                                      {"$set": {"fingerprint": fingerprint,
+                                                "mtime": node.read_mtime()}}))
+            if len(requests) >= batch_size:
+                n += self.collection.bulk_write(requests,
+                                                ordered=False).modified_count
+                requests = []
+        if len(requests) > 0:
+            n += self.collection.bulk_write(requests,
+                                            ordered=False).modified_count
+        return n
+
+    def make_dir_document(self, dirname, wrapperclass, absolute_path=True):
+        """make a document of files under dirname directory
+
+        Parameters
+        ----------
+        dirname: string
+            directory name
+
+        wrapperclass: class
+            a class to load information
+            must has .as_dict() to save into the database
+            lazy=True is passed if it accepts, not to change the directory
+
+        absolute_path: boolean
+            True (default) will generate absolute path of dirname in DB
+
+        Returns
+        -------
+        dict: make_lazy_node(wrapperclass, dirname).as_dict()
+        """
+        if absolute_path:
+            dirname = str(Path(dirname).resolve())
+        return make_lazy_node(wrapperclass, dirname).as_dict()
 
     def add_files_under(self, dirname, wrapperclass, absolute_path=True):
         """initialize database using files under dirname directory
@@ -228,19 +842,154 @@ class SubsMaterialsDatabase(object):
         self
         """
 
-        if absolute_path:
-            absolute_dirname = str(Path(dirname).resolve())
-            dic = wrapperclass(absolute_dirname).as_dict()
-        else:
-            dic = wrapperclass(dirname).as_dict()
+        dic = self.make_dir_document(dirname, wrapperclass, absolute_path)
         self.insert_one(dic)
 
         return self
 
-    def initialize_with_dirs(self, location, wrapperclass):
+    def update_files_under(self, dirname, wrapperclass, absolute_path=True):
+        """update the document of files under dirname directory
+
+        The document with the same basedir is replaced in place,
+        or inserted if it doesn't exist.
+        A basedir has one document, as sync_with_dirs() assumes.
+
+        Parameters
+        ----------
+        dirname: string
+            directory name
+
+        wrapperclass: class
+            a class to load information
+            must has .as_dict() to save into the database
+
+        absolute_path: boolean
+            True (default) will generate absolute path of dirname in DB
+
+        Returns
+        -------
+        collection.replace_one() result
+        """
+        dic = self.make_dir_document(dirname, wrapperclass, absolute_path)
+        doc = self.make_document(dic)
+        return self.collection.replace_one({"basedir": doc["basedir"]}, doc,
+                                           upsert=True)
+
+    def add_dirs_in_batches(self, dirlist, wrapperclass, batch_size=1000,
+                            absolute_path=True, verbose=False,
+                            max_workers=None):
+        """add files under directories in dirlist by bulk inserts
+
+        Documents are made batch_size directories at a time and
+        inserted by an unordered insert_many().
+        A directory which can't be read or a document which can't be
+        inserted is recorded in the report and the rest continues.
+        With max_workers, the directories are read by a DirScanner
+        in threads while the documents are inserted.
+
+        Parameters
+        ----------
+        dirlist: a list of string
+            directory names
+
+        wrapperclass: class
+            a class to load information
+            must has .as_dict() to save into the database
+
+        batch_size: int
+            the number of documents in a bulk insert
+
+        absolute_path: boolean
+            True (default) will generate absolute path of dirname in DB
+
+        verbose: boolean
+            print progress of every batch
+
+        max_workers: int (default: None)
+            the number of threads to read directories,
+            read one by one if None
+
+        Returns
+        -------
+        dict: report of the ingestion
+            ndirs, ninserted, nfailed, nbatches, elapsed, throughput
+            and errors, a list of {"batch", "dirname", "errmsg"}
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive, "
+                             "but {}".format(batch_size))
+        report = {"ndirs": 0, "ninserted": 0, "nfailed": 0, "nbatches": 0,
+                  "elapsed": 0.0, "throughput": 0.0, "errors": []}
+        start = time.time()
+
+        def flush(docs, dirnames):
+            ibatch = report["nbatches"]
+            report["nbatches"] += 1
+            if len(docs) == 0:
+                return
+            try:
+                ret = self.insert_many(docs, ordered=False)
+                ninserted = len(ret.inserted_ids)
+            except BulkWriteError as e:
+                ninserted = e.details.get("nInserted", 0)
+                for err in e.details.get("writeErrors", []):
+                    report["errors"].append(
+                        {"batch": ibatch, "dirname": dirnames[err["index"]],
+                         "errmsg": err.get("errmsg")})
+            report["ninserted"] += ninserted
+            report["nfailed"] += len(docs) - ninserted
+            if verbose:
+                print("batch {}: {} inserted, {} failed".format(
+                    ibatch, ninserted, len(docs) - ninserted))
+
+        def make_dir_document(dirname):
+            return self.make_dir_document(dirname, wrapperclass,
+                                          absolute_path)
+
+        if max_workers is None:
+            results = DirScanner(make_dir_document).scan_serial(dirlist)
+        else:
+            scanner = DirScanner(make_dir_document, max_workers=max_workers)
+            results = scanner.scan(dirlist)
+
+        docs = []
+        dirnames = []
+        for dirname, doc, error in results:
+            report["ndirs"] += 1
+            if error is not None:
+                report["nfailed"] += 1
+                report["errors"].append({"batch": report["nbatches"],
+                                         "dirname": dirname,
+                                         "errmsg": repr(error)})
+                continue
+            docs.append(doc)
+            dirnames.append(dirname)
+            if len(docs) >= batch_size:
+                flush(docs, dirnames)
+                docs = []
+                dirnames = []
+        if len(docs) > 0:
+            flush(docs, dirnames)
+
+        report["elapsed"] = time.time() - start
+        if report["elapsed"] > 0:
+            report["throughput"] = report["ninserted"] / report["elapsed"]
+        if verbose:
+            print("{} documents inserted, {} failed, "
+                  "{:.1f} documents/s".format(report["ninserted"],
+                                              report["nfailed"],
+                                              report["throughput"]))
+        return report
+
+    def initialize_with_dirs(self, location, wrapperclass, batch_size=None,
+                             verbose=False, max_workers=None):
         """initialize database using files under location directory
 
-        It uses self.add_files_under().
+        It uses self.add_files_under() if batch_size is None,
+        or self.add_dirs_in_batches() otherwise.
+        The report of the batch ingestion is stored in self.ingest_report.
+        In the batch ingestion, the directories are listed by
+        scanner.iter_dirs() and streamed to the inserts.
 
         Parameters
         ----------
@@ -251,14 +1000,430 @@ class SubsMaterialsDatabase(object):
             a class to load information
             must has .as_dict() to save into the database
 
+        batch_size: int (default: None)
+            the number of documents in a bulk insert
+
+        verbose: boolean
+            print progress of the batch ingestion
+
+        max_workers: int (default: None)
+            the number of threads to read directories in the batch
+            ingestion, see add_dirs_in_batches()
+
         Returns
         -------
         self
         """
 
         self.collection_remove()
-        dirlist = glob.glob(os.path.join(location))
-        for dirname in dirlist:
-            self.add_files_under(dirname, wrapperclass)
+        if batch_size is None:
+            dirlist = glob.glob(os.path.join(location))
+            for dirname in dirlist:
+                self.add_files_under(dirname, wrapperclass)
+        else:
+            self.ingest_report = self.add_dirs_in_batches(
+                iter_dirs(location), wrapperclass, batch_size=batch_size,
+                verbose=verbose, max_workers=max_workers)
 
         return self
+
+    def sync_with_dirs(self, location, wrapperclass, batch_size=1000,
+                       verbose=False):
+        """synchronize database with files under location directory
+
+        Unlike initialize_with_dirs(), the collection is not removed.
+        The directories are compared with the documents by basedir
+        and by the modification time of the metadata files
+        (make_lazy_node(wrapperclass, dirname).read_mtime()).
+        New directories are inserted, changed ones are replaced,
+        and documents whose basedir matches location but no longer exists
+        are deleted.
+        Unchanged directories only cost the stat of the metadata files.
+
+        The report is stored in self.ingest_report.
+
+        Parameters
+        ----------
+        location: string
+            directory name to pass glob.glob
+
+        wrapperclass: class
+            a class to load information
+            must has .as_dict() and .read_mtime(),
+            lazy=True is passed if it accepts
+
+        batch_size: int
+            the number of operations in a bulk write
+
+        verbose: boolean
+            print the report
+
+        Returns
+        -------
+        self
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive, "
+                             "but {}".format(batch_size))
+        report = {"ndirs": 0, "ninserted": 0, "nupdated": 0, "ndeleted": 0,
+                  "nunchanged": 0, "nfailed": 0, "nbatches": 0,
+                  "elapsed": 0.0, "errors": []}
+        start = time.time()
+
+        abs_location = str(Path(location).resolve())
+        known = {}
+        obsolete = []
+        for doc in self.collection.find({}, {"basedir": 1, "mtime": 1}):
+            basedir = doc.get("basedir")
+            if basedir is None or not match_dir(abs_location, basedir):
+                continue
+            if basedir in known:
+                # duplicated documents of the same basedir
+                obsolete.append(doc["_id"])
+            else:
+                known[basedir] = doc
+
+        def flush(requests, dirnames):
+            ibatch = report["nbatches"]
+            report["nbatches"] += 1
+            try:
+                ret = self.collection.bulk_write(requests, ordered=False)
+                details = ret.bulk_api_result
+            except BulkWriteError as e:
+                details = e.details
+                for err in details.get("writeErrors", []):
+                    report["errors"].append(
+                        {"batch": ibatch, "dirname": dirnames[err["index"]],
+                         "errmsg": err.get("errmsg")})
+                report["nfailed"] += len(details.get("writeErrors", []))
+            report["ninserted"] += details.get("nInserted", 0)
+            report["nupdated"] += details.get("nModified", 0)
+            report["ndeleted"] += details.get("nRemoved", 0)
+
+        requests = []
+        dirnames = []
+        for dirname in glob.glob(location):
+            report["ndirs"] += 1
+            basedir = str(Path(dirname).resolve())
+            doc = known.pop(basedir, None)
+            try:
+                node = make_lazy_node(wrapperclass, basedir)
+                if doc is not None and doc.get("mtime") == node.read_mtime():
+                    report["nunchanged"] += 1
+                    continue
+                newdoc = self.make_document(node.as_dict())
+            except Exception as e:
+                report["nfailed"] += 1
+                report["errors"].append({"batch": report["nbatches"],
+                                         "dirname": dirname,
+                                         "errmsg": repr(e)})
+                continue
+            if doc is None:
+                requests.append(InsertOne(newdoc))
+            else:
+                requests.append(ReplaceOne({"_id": doc["_id"]}, newdoc))
+            dirnames.append(dirname)
+            if len(requests) >= batch_size:
+                flush(requests, dirnames)
+                requests = []
+                dirnames = []
+
+        obsolete.extend([doc["_id"] for doc in known.values()])
+        for i in range(0, len(obsolete), batch_size):
+            ids = obsolete[i:i+batch_size]
+            requests.append(DeleteMany({"_id": {"$in": ids}}))
+            dirnames.append(None)
+        if len(requests) > 0:
+            flush(requests, dirnames)
+
+        report["elapsed"] = time.time() - start
+        self.ingest_report = report
+        if verbose:
+            print("{} inserted, {} updated, {} deleted, {} unchanged, "
+                  "{} failed".format(report["ninserted"], report["nupdated"],
+                                     report["ndeleted"], report["nunchanged"],
+                                     report["nfailed"]))
+        return self
+
+    def state_query(self, state):
+        """make query from state
+
+        Parameters
+        ----------
+        state: string or dict
+            achievement, e.g., "to_relax",
+            or fields, e.g., {"purpose": "converged_ionic",
+                              "achievement": "to_relax"}
+
+        Returns
+        -------
+        dict: fields of the state
+        """
+        if isinstance(state, str):
+            return {"achievement": state}
+        return dict(state)
+
+    def _update_node_metadata(self, wrapperclass, basedir, uuid, fields):
+        """update the metadata file of the current directory of a node
+
+        Parameters
+        ----------
+        wrapperclass: class
+            a class to access the node
+
+        basedir: string
+            base directory of the node
+
+        uuid: string
+            uuid of the current directory which the document has
+
+        fields: dict
+            fields to update
+
+        Returns
+        -------
+        int: the modification time of the node after the update
+
+        Raises
+        ------
+        ValueError if the current directory of the node isn't uuid
+        """
+        node = make_lazy_node(wrapperclass, basedir)
+        current_uuid = node.read_currentdir_uuid()
+        if current_uuid != uuid:
+            raise ValueError("the current directory of {} is {}, "
+                             "but {}".format(basedir, current_uuid, uuid))
+        node.update_currentdir_metadata(fields)
+        return node.read_mtime()
+
+    def transition(self, uuid, from_state, to_state, wrapperclass):
+        """change state of a node from from_state to to_state
+
+        The document is changed by a single find_one_and_update()
+        only if it is in from_state, so that only one of processes
+        changing the same node succeeds.
+        Then the metadata file of the current directory is updated
+        if its uuid is still uuid,
+        and the new "mtime" of the node is saved in the document.
+        If the metadata file can't be updated, the document is put back
+        to from_state.
+
+        Parameters
+        ----------
+        uuid: string
+            uuid of the current directory of the node
+
+        from_state: string or dict
+            state before the transition, see state_query()
+
+        to_state: string or dict
+            state after the transition, see state_query()
+
+        wrapperclass: class
+            a class to access the node
+            must has .read_currentdir_uuid(), .update_currentdir_metadata()
+            and .read_mtime(), lazy=True is passed if it accepts
+
+        Returns
+        -------
+        dict: the document after the transition
+        None: if no document is in from_state
+        """
+        from_query = self.state_query(from_state)
+        to_fields = self.state_query(to_state)
+        query = {"uuid": uuid}
+        query.update(from_query)
+        doc = self.collection.find_one_and_update(
+            query, {"$set": to_fields}, return_document=ReturnDocument.AFTER)
+        if doc is None:
+            return None
+        try:
+            mtime = self._update_node_metadata(wrapperclass, doc["basedir"],
+                                               uuid, to_fields)
+        except Exception:
+            self.collection.update_one({"_id": doc["_id"]},
+                                       {"$set": from_query})
+            raise
+        self.collection.update_one({"_id": doc["_id"]},
+                                   {"$set": {"mtime": mtime}})
+        doc["mtime"] = mtime
+        return doc
+
+    def transition_many(self, uuids, from_state, to_state, wrapperclass,
+                        batch_size=1000):
+        """change state of nodes from from_state to to_state
+
+        The bulk version of transition().
+        For each batch, the documents in from_state are changed by
+        an update_many() with a marker, the changed ones are found by
+        the marker, their metadata files are updated,
+        and a bulk write saves their new "mtime" and removes the marker.
+        It costs three round trips per batch.
+        The nodes whose metadata file can't be updated,
+        e.g. whose current directory isn't the uuid any more,
+        are put back to from_state.
+
+        Parameters
+        ----------
+        uuids: a list of string
+            uuids of the current directory of the nodes
+
+        from_state: string or dict
+            state before the transition, see state_query()
+
+        to_state: string or dict
+            state after the transition, see state_query()
+
+        wrapperclass: class
+            a class to access the node
+            must has .read_currentdir_uuid(), .update_currentdir_metadata()
+            and .read_mtime(), lazy=True is passed if it accepts
+
+        batch_size: int
+            the number of nodes in an update_many()
+
+        Returns
+        -------
+        a list of uuids changed
+        """
+        from_query = self.state_query(from_state)
+        to_fields = self.state_query(to_state)
+        uuids = list(uuids)
+        changed = []
+        for i in range(0, len(uuids), batch_size):
+            marker = str(uuid_module.uuid4())
+            query = {"uuid": {"$in": uuids[i:i+batch_size]}}
+            query.update(from_query)
+            fields = dict(to_fields)
+            fields.update({"_transition": marker})
+            self.collection.update_many(query, {"$set": fields})
+            requests = []
+            failed = []
+            for doc in self.collection.find({"_transition": marker},
+                                            {"uuid": 1, "basedir": 1}):
+                try:
+                    mtime = self._update_node_metadata(
+                        wrapperclass, doc["basedir"], doc["uuid"], to_fields)
+                except Exception as e:
+                    print("failed to change {}, {}".format(doc["basedir"],
+                                                           repr(e)))
+                    failed.append(doc["_id"])
+                    continue
+                requests.append(UpdateOne({"_id": doc["_id"]},
+                                          {"$set": {"mtime": mtime},
+                                           "$unset": {"_transition": ""}}))
+                changed.append(doc["uuid"])
+            if len(requests) > 0:
+                self.collection.bulk_write(requests, ordered=False)
+            if len(failed) > 0:
+                self.collection.update_many({"_id": {"$in": failed}},
+                                            {"$set": from_query,
+                                             "$unset": {"_transition": ""}})
+        return changed
+
+    def claim(self, state, worker_id=None, lease_seconds=600):
+        """claim a node in state for worker_id
+
+        A node is claimed by a single find_one_and_update() which sets
+        "lease_owner" and "lease_expires", so that only one worker gets it.
+        A node whose lease has expired can be claimed again.
+        The lease is kept by heartbeat() and released by release().
+        Replacing the document, e.g. by update_files_under(),
+        also releases it.
+
+        The clocks of the hosts of the workers are assumed to be
+        synchronized within a small fraction of lease_seconds.
+
+        Parameters
+        ----------
+        state: string or dict
+            state of the node to claim, see state_query()
+
+        worker_id: string (default: None)
+            id of the worker, "hostname:pid" if None
+
+        lease_seconds: float
+            length of the lease in seconds
+
+        Returns
+        -------
+        dict: the claimed document
+        None: if no node is available
+        """
+        if worker_id is None:
+            worker_id = default_worker_id()
+        now = time.time()
+        query = self.state_query(state)
+        query.update({"$or": [{"lease_expires": {"$exists": False}},
+                              {"lease_expires": {"$lt": now}}]})
+        return self.collection.find_one_and_update(
+            query, {"$set": {"lease_owner": worker_id,
+                             "lease_expires": now + lease_seconds}},
+            return_document=ReturnDocument.AFTER)
+
+    def heartbeat(self, uuid, worker_id=None, lease_seconds=600):
+        """extend the lease of a node claimed by worker_id
+
+        Parameters
+        ----------
+        uuid: string
+            uuid of the current directory of the node
+
+        worker_id: string (default: None)
+            id of the worker, "hostname:pid" if None
+
+        lease_seconds: float
+            length of the lease from now in seconds
+
+        Returns
+        -------
+        boolean: True if the lease is extended,
+                 False if the node is no longer owned by worker_id
+        """
+        if worker_id is None:
+            worker_id = default_worker_id()
+        ret = self.collection.update_one(
+            {"uuid": uuid, "lease_owner": worker_id},
+            {"$set": {"lease_expires": time.time() + lease_seconds}})
+        return ret.matched_count > 0
+
+    def release(self, uuid, worker_id=None):
+        """release the lease of a node claimed by worker_id
+
+        Parameters
+        ----------
+        uuid: string
+            uuid of the current directory of the node
+
+        worker_id: string (default: None)
+            id of the worker, "hostname:pid" if None
+
+        Returns
+        -------
+        boolean: True if released
+        """
+        if worker_id is None:
+            worker_id = default_worker_id()
+        ret = self.collection.update_one(
+            {"uuid": uuid, "lease_owner": worker_id},
+            {"$unset": {"lease_owner": "", "lease_expires": ""}})
+        return ret.modified_count > 0
+
+    def reclaim_expired(self):
+        """remove expired leases
+
+        claim() doesn't need it because an expired node can be claimed,
+        but it cleans up leases of dead workers.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int: the number of reclaimed nodes
+        """
+        ret = self.collection.update_many(
+            {"lease_expires": {"$lt": time.time()}},
+            {"$unset": {"lease_owner": "", "lease_expires": ""}})
+        return ret.modified_count
@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pymatgen.analysis.structure_matcher import StructureMatcher
+
+from .structure import structure_fingerprint
+
+
+def fingerprint_field(matcher_options=None):
+    """return the field of the fingerprint to group structures
+
+    The number of sites of the primitive cell in "key" is
+    an invariant of a match only if the matcher reduces the structures
+    to the primitive cells and doesn't make supercells.
+
+    Parameters
+    ----------
+    matcher_options: dict (default: None)
+        options to pass StructureMatcher()
+
+    Returns
+    -------
+    string: "key" or "reduced_formula"
+    """
+    if matcher_options is None:
+        matcher_options = {}
+    if matcher_options.get("primitive_cell", True) and \
+            not matcher_options.get("attempt_supercell", False) and \
+            not matcher_options.get("allow_subset", False):
+        return "key"
+    return "reduced_formula"
+
+
+def group_by_fingerprint(structures, fingerprints=None, field="key"):
+    """group structures by the fingerprint
+
+    Only the structures in the same group can match by StructureMatcher.
+
+    Parameters
+    ----------
+    structures: a list of pymatgen.Structure
+        structures
+
+    fingerprints: a list of dict (default: None)
+        structure_fingerprint() of structures, made if None
+
+    field: string
+        field of the fingerprint to group by, see fingerprint_field()
+
+    Returns
+    -------
+    dict: {fingerprint[field]: a list of indices of structures}
+    """
+    if fingerprints is None:
+        fingerprints = [structure_fingerprint(x) for x in structures]
+    groups = {}
+    for i, fingerprint in enumerate(fingerprints):
+        groups.setdefault(fingerprint[field], []).append(i)
+    return groups
+
+
+def _reduce_structures(structures, matcher_options):
+    """reduce structures as StructureMatcher does before comparing them
+
+    It runs in a worker process.
+    The results are compared by fit(..., skip_structure_reduction=True),
+    so that a structure is reduced once however many times it is compared.
+
+    Returns
+    -------
+    a list of pymatgen.Structure: Niggli reduced (primitive) structures
+    """
+    primitive_cell = matcher_options.get("primitive_cell", True)
+    reduced = []
+    for structure in structures:
+        structure = structure.get_reduced_structure(reduction_algo="niggli")
+        if primitive_cell:
+            structure = structure.get_primitive_structure()
+        reduced.append(structure)
+    return reduced
+
+
+def _cluster_structures(structures, indices, matcher_options):
+    """group reduced structures which match the first of a group
+
+    It runs in a worker process.
+    It is the same as StructureMatcher.group_structures(),
+    but the groups are made of indices.
+
+    Returns
+    -------
+    a list of lists of indices
+    """
+    matcher = StructureMatcher(**matcher_options)
+    leaders = []
+    clusters = []
+    for structure, i in zip(structures, indices):
+        for leader, cluster in zip(leaders, clusters):
+            if matcher.fit(leader, structure, skip_structure_reduction=True):
+                cluster.append(i)
+                break
+        else:
+            leaders.append(structure)
+            clusters.append([i])
+    return clusters
+
+
+def _match_structures(structures, references, indices, matcher_options):
+    """find the first matched reference of each reduced structure
+
+    It runs in a worker process.
+
+    Returns
+    -------
+    a list of (index of structures, index of references or None)
+    """
+    matcher = StructureMatcher(**matcher_options)
+    reference_indices, references = references
+    matches = []
+    for structure, i in zip(structures, indices):
+        matched = None
+        for reference, j in zip(references, reference_indices):
+            if matcher.fit(structure, reference,
+                           skip_structure_reduction=True):
+                matched = j
+                break
+        matches.append((i, matched))
+    return matches
+
+
+class StructureDeduplicator(object):
+    """find duplicated structures by StructureMatcher in parallel
+
+    Structures are grouped by the fingerprint at first.
+    A structure joins the first cluster whose first structure matches it
+    as in StructureMatcher.group_structures().
+    A large group is processed chunk by chunk;
+    the structures of a chunk are compared with the first structures
+    of the clusters so far in the worker processes,
+    and the rest are grouped among themselves,
+    so that a single large group also uses all the workers.
+    Each structure is reduced once in a worker before the comparisons.
+    """
+
+    # the smallest number of structures in a task
+    MIN_CHUNK_SIZE = 4
+
+    def __init__(self, max_workers=None, matcher_options=None,
+                 executor=None, chunk_size=None):
+        """initialization
+
+        Parameters
+        ----------
+        max_workers: int (default: None)
+            the number of worker processes, os.cpu_count() if None
+            No process is made if it is 1.
+
+        matcher_options: dict (default: None)
+            options to pass StructureMatcher()
+
+        executor: concurrent.futures.Executor (default: None)
+            executor to use instead of making a process pool every call
+
+        chunk_size: int (default: None)
+            the number of structures of a group processed at a time,
+            made from max_workers and the size of the group if None
+        """
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        if matcher_options is None:
+            matcher_options = {}
+        self.matcher_options = matcher_options
+        # field of the fingerprint to group by
+        self.fingerprint_field = fingerprint_field(matcher_options)
+        self.executor = executor
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("chunk_size must be positive, "
+                             "but {}".format(chunk_size))
+        self.chunk_size = chunk_size
+
+    def _map(self, func, tasks):
+        """call func(*task) for each task
+
+        The results are returned in the order of tasks.
+        """
+        if self.max_workers == 1 or len(tasks) <= 1:
+            return [func(*task) for task in tasks]
+        # large tasks first to balance the workers
+        order = sorted(range(len(tasks)), key=lambda i: -len(tasks[i][0]))
+        if self.executor is not None:
+            futures = {i: self.executor.submit(func, *tasks[i])
+                       for i in order}
+            return [futures[i].result() for i in range(len(tasks))]
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {i: executor.submit(func, *tasks[i]) for i in order}
+            return [futures[i].result() for i in range(len(tasks))]
+
+    def _split(self, indices):
+        """split indices into tasks for the workers
+        """
+        size = max(self.MIN_CHUNK_SIZE, -(-len(indices) // self.max_workers))
+        return [indices[i:i+size] for i in range(0, len(indices), size)]
+
+    def _chunks(self, indices):
+        """split indices of a group into chunks processed at a time
+        """
+        size = self.chunk_size
+        if size is None:
+            if self.max_workers == 1:
+                size = len(indices)
+            else:
+                size = max(self.MIN_CHUNK_SIZE * self.max_workers,
+                           -(-len(indices) // (4 * self.max_workers)))
+        return [indices[i:i+size] for i in range(0, len(indices), size)]
+
+    def _reduce(self, structures, indices):
+        """reduce structures[i] for i in indices in the workers
+
+        Returns
+        -------
+        dict: {i: the reduced structure}
+        """
+        tasks = self._split(indices)
+        results = self._map(_reduce_structures,
+                            [([structures[i] for i in task],
+                              self.matcher_options) for task in tasks])
+        reduced = {}
+        for task, result in zip(tasks, results):
+            reduced.update(zip(task, result))
+        return reduced
+
+    def reduce(self, structures):
+        """reduce structures as StructureMatcher does in the workers
+
+        The results can be passed to match() with reduced_references=True,
+        so that references used many times are reduced once.
+
+        Parameters
+        ----------
+        structures: a list of pymatgen.Structure
+            structures
+
+        Returns
+        -------
+        a list of pymatgen.Structure: reduced structures
+        """
+        reduced = self._reduce(structures, list(range(len(structures))))
+        return [reduced[i] for i in range(len(structures))]
+
+    def clusters(self, structures, fingerprints=None):
+        """group structures which match each other
+
+        Parameters
+        ----------
+        structures: a list of pymatgen.Structure
+            structures
+
+        fingerprints: a list of dict (default: None)
+            structure_fingerprint() of structures, made if None
+
+        Returns
+        -------
+        a list of lists of indices of structures
+            All the structures are in one of the clusters.
+            The first index in a cluster is the smallest.
+        """
+        groups = group_by_fingerprint(structures, fingerprints,
+                                      self.fingerprint_field)
+        clusters = [x for x in groups.values() if len(x) == 1]
+        groups = [x for x in groups.values() if len(x) > 1]
+        reduced = self._reduce(structures, [i for x in groups for i in x])
+
+        chunks = [self._chunks(x) for x in groups]
+        # the first structures of the clusters and the clusters of groups
+        leaders = [[] for _ in groups]
+        members = [{} for _ in groups]
+        nchunks = max([len(x) for x in chunks], default=0)
+        for ichunk in range(nchunks):
+            active = [g for g in range(len(groups))
+                      if ichunk < len(chunks[g])]
+            unmatched = {g: list(chunks[g][ichunk]) for g in active}
+
+            # compare the chunk with the clusters so far
+            tasks = []
+            owners = []
+            for g in active:
+                if len(leaders[g]) == 0:
+                    continue
+                references = (leaders[g], [reduced[j] for j in leaders[g]])
+                for task in self._split(chunks[g][ichunk]):
+                    tasks.append(([reduced[i] for i in task], references,
+                                  task, self.matcher_options))
+                    owners.append(g)
+            for g, result in zip(owners,
+                                 self._map(_match_structures, tasks)):
+                matched = set()
+                for i, j in result:
+                    if j is not None:
+                        members[g][j].append(i)
+                        matched.add(i)
+                unmatched[g] = [i for i in unmatched[g] if i not in matched]
+
+            # the rest make new clusters
+            owners = [g for g in active if len(unmatched[g]) > 0]
+            tasks = [([reduced[i] for i in unmatched[g]], unmatched[g],
+                      self.matcher_options) for g in owners]
+            for g, result in zip(owners,
+                                 self._map(_cluster_structures, tasks)):
+                for cluster in result:
+                    leaders[g].append(cluster[0])
+                    members[g][cluster[0]] = cluster
+
+        for x in members:
+            clusters.extend(x.values())
+        clusters = [sorted(x) for x in clusters]
+        clusters.sort()
+        return clusters
+
+    def duplicates(self, structures, fingerprints=None):
+        """find duplicated structures
+
+        Parameters
+        ----------
+        structures: a list of pymatgen.Structure
+            structures
+
+        fingerprints: a list of dict (default: None)
+            structure_fingerprint() of structures, made if None
+
+        Returns
+        -------
+        a list of lists of indices of structures
+            clusters which have more than one structures
+        """
+        return [x for x in self.clusters(structures, fingerprints)
+                if len(x) > 1]
+
+    def unique(self, structures, fingerprints=None):
+        """find structures to keep
+
+        Parameters
+        ----------
+        structures: a list of pymatgen.Structure
+            structures
+
+        fingerprints: a list of dict (default: None)
+            structure_fingerprint() of structures, made if None
+
+        Returns
+        -------
+        a list of int: the first index of each cluster
+        """
+        return [x[0] for x in self.clusters(structures, fingerprints)]
+
+    def match(self, structures, references, fingerprints=None,
+              reference_fingerprints=None, reduced_references=False):
+        """find a matched reference of each structure
+
+        Parameters
+        ----------
+        structures: a list of pymatgen.Structure
+            structures to check
+
+        references: a list of pymatgen.Structure
+            structures already known
+
+        fingerprints: a list of dict (default: None)
+            structure_fingerprint() of structures, made if None
+
+        reference_fingerprints: a list of dict (default: None)
+            structure_fingerprint() of references, made if None
+
+        reduced_references: boolean
+            references are already reduced by reduce()
+
+        Returns
+        -------
+        a list: an index of references or None for each structure
+        """
+        groups = group_by_fingerprint(structures, fingerprints,
+                                      self.fingerprint_field)
+        reference_groups = group_by_fingerprint(references,
+                                                reference_fingerprints,
+                                                self.fingerprint_field)
+        keys = [key for key in groups if key in reference_groups]
+        reduced = self._reduce(structures,
+                               [i for key in keys for i in groups[key]])
+        indices = [j for key in keys for j in reference_groups[key]]
+        if reduced_references:
+            reduced_references = {j: references[j] for j in indices}
+        else:
+            reduced_references = self._reduce(references, indices)
+        matches = [None] * len(structures)
+        tasks = []
+        for key in keys:
+            reference_indices = reference_groups[key]
+            group_references = (reference_indices,
+                                [reduced_references[j]
+                                 for j in reference_indices])
+            for chunk in self._split(groups[key]):
+                tasks.append(([reduced[i] for i in chunk], group_references,
+                              chunk, self.matcher_options))
+        for result in self._map(_match_structures, tasks):
+            for i, j in result:
+                matches[i] = j
+        return matches
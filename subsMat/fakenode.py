@@ -1,7 +1,6 @@
 import json
 import os
 import random
-from pymatgen.core.structure import Structure
 from pymatgen.io.vasp.sets import MITRelaxSet
 
 from .node import StructureNode
@@ -11,8 +10,8 @@ class fakeVaspRunNode(StructureNode):
     """fake VASP class to run without VASP
     """
 
-    def __init__(self, basedir_prefix):
-        super().__init__(basedir_prefix)
+    def __init__(self, basedir_prefix, kind="cif", lazy=False, store=None):
+        super().__init__(basedir_prefix, kind=kind, lazy=lazy, store=store)
 
         self.result_status_file = "outcar.json"
         self.accept_ratio = 0.20
@@ -72,13 +71,11 @@ class fakeVaspRunNode(StructureNode):
         -------
         None
         """
-        current_dir = self.get_currentdir()
-        metadata_file = os.path.join(current_dir, self.metadata_file)
-        with open(metadata_file) as f:
-            metadata = json.loads(f.read())
-        positionpath = os.path.join(current_dir, metadata["positionfile"])
-        structure = Structure.from_file(positionpath)
+        structure = self.load_structure()
         source_uuid = self.read_currentdir_uuid()
+        # the new step keeps the kind of the structure file
+        dic = self.load_currentdir_metadata()
+        self.structurefile_kind = dic.get("kind", self.structurefile_kind)
         self.set_new_step()
         metadata = {"purpose": "converged_ionic", "achievement": "to_relax"}
         super().place_files(structure, source_uuid=source_uuid,
@@ -103,8 +100,8 @@ class fakeVaspRunNode(StructureNode):
 
         self.update_currentdir_metadata({"achievement": "running"})
 
-    def run_result(self):
-        """get result of dry run
+    def write_result(self):
+        """write the result of dry run without changing the metadata
 
         Parameters
         ----------
@@ -114,8 +111,6 @@ class fakeVaspRunNode(StructureNode):
         -------
         dic: the content of self.result_status_file
         """
-
-        self.update_currentdir_metadata({"achievement": "executed"})
         i_conv = random.random() > self.accept_ratio
         e_conv = True
         dic = {"converged_electronic": e_conv, "converged_ionic": i_conv}
@@ -124,6 +119,37 @@ class fakeVaspRunNode(StructureNode):
             f.write(json.dumps(dic))
         return dic
 
+    def remove_result(self):
+        """remove the result written by write_result()
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        filename = os.path.join(self.get_currentdir(), self.result_status_file)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def run_result(self):
+        """get result of dry run
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dic: the content of self.result_status_file
+        """
+        dic = self.write_result()
+        # executed only after the result is written
+        self.update_currentdir_metadata({"achievement": "executed"})
+        return dic
+
     def check_result(self):
         """check vasp result
             read result from self.result_status_file
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sqlite3
+import threading
+import time
+
+from .misc import atomic_write
+
+
+class LocalFileStore(object):
+    """small files of nodes as files in the directories
+
+    It is the default store of DirNode.
+    """
+
+    def read(self, filename):
+        """read the content of filename
+
+        Parameters
+        ----------
+        filename: string
+            file name
+
+        Returns
+        -------
+        string: the content
+
+        Raises
+        ------
+        FileNotFoundError if filename doesn't exist
+        """
+        with open(filename) as f:
+            return f.read()
+
+    def write(self, filename, text, fsync=False):
+        """write text to filename atomically
+
+        Parameters
+        ----------
+        filename: string
+            file name
+
+        text: string
+            the content
+
+        fsync: boolean
+            see atomic_write()
+
+        Returns
+        -------
+        None
+        """
+        atomic_write(filename, text, fsync=fsync)
+
+    def exists(self, filename):
+        """return True if filename exists
+        """
+        return os.path.isfile(filename)
+
+    def remove(self, filename):
+        """remove filename
+
+        Raises
+        ------
+        FileNotFoundError if filename doesn't exist
+        """
+        os.remove(filename)
+
+    def mtime_ns(self, filename):
+        """return the modification time of filename in ns
+
+        Raises
+        ------
+        FileNotFoundError if filename doesn't exist
+        """
+        return os.stat(filename).st_mtime_ns
+
+
+# store used by DirNode by default
+local_store = LocalFileStore()
+
+
+def _file_id(st):
+    """return what identifies the content of a file from os.stat()
+    """
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class ManifestStore(object):
+    """small files of nodes in one SQLite file under a calculation root
+
+    The metadata and uuid files of all the nodes under root are kept
+    as rows of root/MANIFEST_NAME instead of millions of tiny files.
+    Use it by DirNode(basedir, store=ManifestStore(root)).
+    export_files() writes them back as files for the other tools,
+    and import_files() reads the files into the manifest.
+    """
+
+    MANIFEST_NAME = "manifest.sqlite"
+
+    # small files kept in the manifest by import_files()
+    FILENAMES = ["metadata.json", "_uuid"]
+
+    def __init__(self, root, timeout=60):
+        """initialize ManifestStore
+
+        Parameters
+        ----------
+        root: string
+            calculation root directory
+
+        timeout: float
+            seconds to wait for a lock of the SQLite file
+        """
+        self.root = os.path.realpath(root)
+        self.timeout = timeout
+        self.path = os.path.join(self.root, self.MANIFEST_NAME)
+        self.__local = threading.local()
+
+    def __getstate__(self):
+        # connections are made again in the other process
+        return {"root": self.root, "timeout": self.timeout}
+
+    def __setstate__(self, state):
+        self.__init__(state["root"], timeout=state["timeout"])
+
+    @property
+    def connection(self):
+        """sqlite3 connection of this process and thread
+        """
+        local = self.__local
+        if getattr(local, "pid", None) != os.getpid():
+            if not os.path.isdir(self.root):
+                os.makedirs(self.root)
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, content TEXT NOT NULL, "
+                "mtime_ns INTEGER NOT NULL)")
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def key(self, filename):
+        """make the key of filename, the path relative to root
+
+        The directories of filename and root are resolved by realpath(),
+        so that a path through a symbolic link gives the same key.
+
+        Raises
+        ------
+        ValueError if filename isn't under root
+        """
+        dirname, name = os.path.split(os.path.abspath(filename))
+        path = os.path.relpath(os.path.join(os.path.realpath(dirname), name),
+                               self.root)
+        if path == os.pardir or path.startswith(os.pardir + os.sep):
+            raise ValueError("{} is not under {}".format(filename,
+                                                         self.root))
+        return path
+
+    def read(self, filename):
+        """read the content of filename
+
+        Raises
+        ------
+        FileNotFoundError if filename isn't in the manifest
+        """
+        row = self.connection.execute(
+            "SELECT content FROM files WHERE path=?",
+            (self.key(filename),)).fetchone()
+        if row is None:
+            raise FileNotFoundError(filename)
+        return row[0]
+
+    def write(self, filename, text, fsync=False):
+        """write text as filename
+
+        A row is replaced in a transaction, so it is atomic.
+        fsync is not used because SQLite syncs its file.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files (path, content, mtime_ns) "
+            "VALUES (?, ?, ?)", (self.key(filename), text, time.time_ns()))
+
+    def exists(self, filename):
+        """return True if filename is in the manifest
+        """
+        row = self.connection.execute(
+            "SELECT 1 FROM files WHERE path=?",
+            (self.key(filename),)).fetchone()
+        return row is not None
+
+    def remove(self, filename):
+        """remove filename from the manifest
+
+        Raises
+        ------
+        FileNotFoundError if filename isn't in the manifest
+        """
+        cursor = self.connection.execute(
+            "DELETE FROM files WHERE path=?", (self.key(filename),))
+        if cursor.rowcount == 0:
+            raise FileNotFoundError(filename)
+
+    def mtime_ns(self, filename):
+        """return the time when filename is written in ns
+
+        Raises
+        ------
+        FileNotFoundError if filename isn't in the manifest
+        """
+        row = self.connection.execute(
+            "SELECT mtime_ns FROM files WHERE path=?",
+            (self.key(filename),)).fetchone()
+        if row is None:
+            raise FileNotFoundError(filename)
+        return row[0]
+
+    def import_files(self, remove=False):
+        """read the small files under root into the manifest
+
+        A row written by write() after the file was read is newer
+        than the file, and it isn't replaced.
+        A file is removed only if it is still the one which was read,
+        i.e., its inode, mtime and size are unchanged.
+        A file written meanwhile, e.g., by os.replace() of a worker,
+        is kept and imported by the next call.
+        Run it with remove=True when no worker uses the files
+        through LocalFileStore, which can't read the removed files.
+
+        Parameters
+        ----------
+        remove: boolean
+            remove the files after they are imported
+
+        Returns
+        -------
+        int: the number of imported files, except the ones older than rows
+        """
+        rows = []
+        stats = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name not in self.FILENAMES:
+                    continue
+                filename = os.path.join(dirpath, name)
+                try:
+                    with open(filename) as f:
+                        text = f.read()
+                        st = os.fstat(f.fileno())
+                except FileNotFoundError:
+                    continue
+                rows.append((self.key(filename), text, st.st_mtime_ns))
+                stats.append((filename, _file_id(st)))
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            n = connection.executemany(
+                "INSERT INTO files (path, content, mtime_ns) "
+                "VALUES (?, ?, ?) ON CONFLICT(path) DO UPDATE SET "
+                "content=excluded.content, mtime_ns=excluded.mtime_ns "
+                "WHERE excluded.mtime_ns >= files.mtime_ns", rows).rowcount
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if remove:
+            for filename, file_id in stats:
+                try:
+                    if _file_id(os.stat(filename)) == file_id:
+                        os.remove(filename)
+                except FileNotFoundError:
+                    pass
+        return n
+
+    def export_files(self, root=None):
+        """write the files in the manifest as files
+
+        Parameters
+        ----------
+        root: string (default: None)
+            directory to write to, self.root if None
+
+        Returns
+        -------
+        int: the number of written files
+        """
+        if root is None:
+            root = self.root
+        n = 0
+        for path, text in self.connection.execute(
+                "SELECT path, content FROM files ORDER BY path"):
+            filename = os.path.join(root, path)
+            dirname = os.path.dirname(filename)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            atomic_write(filename, text)
+            n += 1
+        return n
@@ -1,10 +1,122 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import hashlib
+import math
+import os
+import threading
 from collections import Counter
+from functools import reduce
 
+from pymatgen.core.periodic_table import Element, get_el_sp
 
-def element_list(species):
+
+# element symbols indexed by the atomic number
+_symbols = [""] + [Element.from_Z(z).symbol for z in range(1, 119)]
+_numbers = {x: z for z, x in enumerate(_symbols) if z > 0}
+
+ELEMENT_LIST_ORDERS = ["hill", "z"]
+
+
+def _element(name):
+    """get (atomic number, element symbol) of a species name
+    """
+    z = _numbers.get(name)
+    if z is not None:
+        return z, name
+    try:
+        x = get_el_sp(name)
+        return x.Z, x.symbol
+    except (ValueError, AttributeError):
+        return 0, name
+
+
+def _sort_key(order, has_carbon):
+    """make a key function of [symbol, count] to sort element lists
+    """
+    def z_key(x):
+        return (_element(x[0])[0], x[0])
+
+    def hill_key(x):
+        symbol = _element(x[0])[1]
+        if has_carbon and symbol in ["C", "H"]:
+            return (0, ["C", "H"].index(symbol), x[0])
+        return (1, symbol, x[0])
+
+    if order == "z":
+        return z_key
+    elif order == "hill":
+        return hill_key
+    raise ValueError("order must be one of {}, but {}".format(
+        ELEMENT_LIST_ORDERS, order))
+
+
+def sort_element_list(elementlist, order="hill"):
+    """sort an element list in the canonical order
+
+    Parameters
+    ----------
+    elementlist: a list of [string, int]
+        species and the number, e.g., [["Yb", 1], ["Au", 4]]
+
+    order: string
+        "hill": C, H and the others alphabetically if C exists,
+                all alphabetically otherwise
+        "z": by the atomic number
+
+    Returns
+    -------
+    a list of [string, int]: sorted elementlist
+    """
+    symbols = [x[0] for x in elementlist]
+    return sorted(elementlist, key=_sort_key(order, "C" in symbols))
+
+
+def atomic_write(filename, text, fsync=False):
+    """write text to filename atomically
+
+    text is written to a temporary file in the same directory,
+    which then replaces filename by os.replace(),
+    so filename has the old or the new content even if the process dies.
+
+    Parameters
+    ----------
+    filename: string
+        file name
+
+    text: string
+        content of the file
+
+    fsync: boolean
+        os.fsync() the file and the directory,
+        so that the content also survives a crash of the machine
+
+    Returns
+    -------
+    None
+    """
+    tmpfile = "{}.{}.{}.tmp".format(filename, os.getpid(),
+                                    threading.get_ident())
+    try:
+        with open(tmpfile, "w") as f:
+            f.write(text)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmpfile, filename)
+    except BaseException:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+    if fsync:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def element_list(species, order=None):
     """make species of material
 
     helper subroutine
@@ -14,6 +126,11 @@ def element_list(species):
     species: a list of atomic species
         material species
 
+    order: string (default: None)
+        None keeps the order of the first appearance,
+        otherwise see sort_element_list()
+        Equal compositions give the same list if order is given.
+
     Returns
     -------
     species: dict (Structure.species)
@@ -22,4 +139,36 @@ def element_list(species):
     elementlist = []
     for x in counter:
         elementlist.append([str(x), counter[x]])
+    if order is not None:
+        elementlist = sort_element_list(elementlist, order)
     return elementlist
+
+
+def composition_key(species):
+    """make the canonical composition key of material
+
+    It doesn't depend on the order of species.
+
+    Parameters
+    ----------
+    species: a list of [string, int]
+        species and the number, e.g., [["Yb", 1], ["Au", 4]]
+
+    Returns
+    -------
+    dict: {"reduced_formula": string, "hash": string}
+        reduced_formula in Hill order, e.g., "Au4Yb", and
+        the hash of the full formula, e.g., of "Au4Yb1"
+    """
+    counter = Counter()
+    for name, n in species:
+        counter[name] += n
+    elementlist = sort_element_list([[x, counter[x]] for x in counter],
+                                    "hill")
+    formula = "".join(["{}{}".format(x, n) for x, n in elementlist])
+    divisor = reduce(math.gcd, [n for _, n in elementlist], 0) or 1
+    reduced_formula = "".join(
+        [x if n == divisor else "{}{}".format(x, n // divisor)
+         for x, n in elementlist])
+    formula_hash = hashlib.sha1(formula.encode()).hexdigest()[:16]
+    return {"reduced_formula": reduced_formula, "hash": formula_hash}
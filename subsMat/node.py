@@ -4,12 +4,15 @@
 import json
 import os
 import uuid
+from contextlib import contextmanager
 
 from pymatgen.io.vasp.inputs import Poscar
 from pymatgen.io.cif import CifWriter
 
+from .filestore import local_store
 from .misc import element_list
-from .structure import SubsStructure
+from .structure import (StructureRecord, SubsStructure,
+                        structure_fingerprint, structure_to_npy)
 
 
 def subs_elms_to_prefix(subs_elm):
@@ -46,10 +49,18 @@ class DirNode(object):
 
     self.place_files() creats subdirectory if basedir/{id} doesn't exist.
 
+    With lazy=True, nothing is done in the file system until
+    the information is needed, no file is created on reading,
+    and what is read is cached until the node is changed.
+
+    The metadata and uuid files are read and written through store,
+    files in the directories by default,
+    or rows of a filestore.ManifestStore of the calculation root.
     """
 
     def __init__(self, basedir, hostname="localhost",
-                 metadata_file="metadata.json", uuid_file="_uuid"):
+                 metadata_file="metadata.json", uuid_file="_uuid",
+                 lazy=False, fsync=False, store=None):
         """initialize dir_node
 
         Parameters
@@ -58,20 +69,67 @@ class DirNode(object):
 
         hostname: hostname
 
-        create: boolean
-            create the first directores or not
+        lazy: boolean
+            False makes basedir, its metadata file and uuid now.
+            True does nothing in the file system until it is needed,
+            which is suitable to read many nodes.
+
+        fsync: boolean
+            os.fsync() the files written by the node, see atomic_write()
+
+        store: LocalFileStore or ManifestStore (default: None)
+            store of the metadata and uuid files, local_store if None
         """
         self.__basedir = basedir
-        if not os.path.isdir(basedir):
-            os.makedirs(basedir)
         self.__metadata_file = metadata_file
         self.__uuid_file = uuid_file
-        self.__current_step = self.read_current_step()
-
+        self.__lazy = lazy
+        self.fsync = fsync
+        if store is None:
+            store = local_store
+        self.store = store
+        self.__cache = {}
+        self.__current_step = None
+        if not lazy:
+            self.__prepare_basedir()
+
+    def __prepare_basedir(self):
+        """make basedir, its metadata file and uuid if they don't exist
+        """
         if not os.path.isdir(self.__basedir):
             os.makedirs(self.__basedir)
+        if self.__current_step is None:
+            self.__current_step = self.read_current_step()
         self.save_basedir_uuid()
 
+    def _cached(self, name, func):
+        """return func() cached by name in lazy mode
+
+        Parameters
+        ----------
+        name: string
+            name of the information
+
+        func: function
+            function to read the information
+
+        Returns
+        -------
+        func()
+        """
+        if not self.__lazy:
+            return func()
+        if name not in self.__cache:
+            self.__cache[name] = func()
+        return self.__cache[name]
+
+    def _clear_cache(self):
+        """clear the information cached in lazy mode
+
+        It is called when the node is changed.
+        """
+        self.__cache.clear()
+
     def set_new_step(self, new_step=None):
         """set new current_step
 
@@ -86,7 +144,10 @@ class DirNode(object):
         """
         if new_step is None:
             new_step = str(uuid.uuid4())
+        # changes of the old step are written before leaving it
+        self.flush()
         self.__current_step = new_step
+        self._clear_cache()
 
     def read_current_step(self):
         """return current_step
@@ -104,18 +165,17 @@ class DirNode(object):
         """
         filename = os.path.join(self.__basedir,
                                 self.__metadata_file)
-        status = None
-        if os.path.isfile(filename):
-            with open(filename) as f:
-                status = json.loads(f.read())
-            if status is not None:
-                return status["current_step"]
-        else:
-            current_step = "0"
+        try:
+            status = json.loads(self.store.read(filename))
+            return status["current_step"]
+        except FileNotFoundError:
+            pass
+        current_step = "0"
+        if not self.__lazy:
+            # not created on reading in lazy mode
             status = {"current_step": current_step}
-            with open(filename, "w") as f:
-                f.write(json.dumps(status))
-            return current_step
+            self.store.write(filename, json.dumps(status), fsync=self.fsync)
+        return current_step
 
     def get_currentdir(self):
         """get current directory full path
@@ -132,6 +192,8 @@ class DirNode(object):
             taret directory name with current step
 
         """
+        if self.__current_step is None:
+            self.__current_step = self.read_current_step()
         targetdir = os.path.join(self.__basedir, self.__current_step)
         return targetdir
 
@@ -147,12 +209,38 @@ class DirNode(object):
         uuid: string
             UUID
         """
-        filename = os.path.join(self.get_currentdir(),
-                                self.__uuid_file)
-        uuid = None
-        with open(filename) as f:
-            uuid = f.read()
-        return uuid
+        def read():
+            filename = os.path.join(self.get_currentdir(),
+                                    self.__uuid_file)
+            return self.store.read(filename)
+        return self._cached("currentdir_uuid", read)
+
+    def read_mtime(self):
+        """return the last modification time of the metadata files
+
+        The metadata file of basedir is rewritten when the current step
+        changes, and the metadata file of the current directory is
+        rewritten when its state changes,
+        so the newer one tells whether the node has changed.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int: modification time in ns, 0 if no metadata file exists.
+        """
+        def read():
+            mtime = 0
+            for dirname in [self.__basedir, self.get_currentdir()]:
+                filename = os.path.join(dirname, self.__metadata_file)
+                try:
+                    mtime = max(mtime, self.store.mtime_ns(filename))
+                except FileNotFoundError:
+                    pass
+            return mtime
+        return self._cached("mtime", read)
 
     def save_basedir_metadata_file(self):
         """save basedir metadata file
@@ -168,8 +256,8 @@ class DirNode(object):
         filename = os.path.join(self.__basedir,
                                 self.__metadata_file)
         status = {"current_step": self.__current_step}
-        with open(filename, "w") as f:
-            f.write(json.dumps(status))
+        self.store.write(filename, json.dumps(status), fsync=self.fsync)
+        self._clear_cache()
         return True
 
     def save_basedir_uuid(self):
@@ -189,9 +277,8 @@ class DirNode(object):
 
         filename = os.path.join(self.__basedir,
                                 self.__uuid_file)
-        if not os.path.exists(filename):
-            with open(filename, "w") as f:
-                f.write(str(uuid.uuid4()))
+        if not self.store.exists(filename):
+            self.store.write(filename, str(uuid.uuid4()), fsync=self.fsync)
             return True
         else:
             return False
@@ -216,13 +303,28 @@ class DirNode(object):
             uuidstr = str(uuid.uuid4())
         targetdir = self.get_currentdir()
         filename = os.path.join(targetdir, self.__uuid_file)
-        if not os.path.exists(filename):
-            with open(filename, "w") as f:
-                f.write(uuidstr)
+        if not self.store.exists(filename):
+            self.store.write(filename, uuidstr, fsync=self.fsync)
             return True
         else:
             return False
 
+    def flush(self):
+        """write the changes kept in memory
+
+        DirNode writes everything at once, so nothing is done.
+        A subclass which defers writes overrides it.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        boolean: True if something is written
+        """
+        return False
+
     def place_files(self):
         """place files on the current subdirectory.
 
@@ -237,7 +339,27 @@ class DirNode(object):
         -------
         boolean: always True
         """
+        self._make_step()
+        self.save_basedir_metadata_file()
+
+        return True
 
+    def _make_step(self):
+        """make the directory and uuid of the new step
+
+        The basedir metadata file isn't changed,
+        so that a subclass writes the files of the step
+        before save_basedir_metadata_file() makes it current.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        boolean: always True
+        """
+        self.__prepare_basedir()
         targetdir = self.get_currentdir()
         # make directory if not exist
         if os.path.isdir(targetdir):
@@ -254,7 +376,7 @@ class DirNode(object):
         else:
             os.makedirs(targetdir)
             self.save_currentdir_uuid()
-        self.save_basedir_metadata_file()
+        self._clear_cache()
 
         return True
 
@@ -272,23 +394,46 @@ class DirNode(object):
         dict: information of the content
         """
         hostname = "localhost"
+        mtime = self.read_mtime()
         uuid = self.read_currentdir_uuid()
         dic = {"hostname": hostname,
                "basedir": self.__basedir,
-               "uuid": uuid}
+               "uuid": uuid,
+               "mtime": mtime}
         return dic
 
 
 class StructureNode(DirNode):
     """vasp directory access interface
+
+    With write_back=True, or in metadata_batch(),
+    the metadata of the current directory is kept in memory
+    after it is read or saved,
+    save_currentdir_metadata() only changes it in memory
+    and flush() writes the file once.
+    Otherwise the file is read every time,
+    so that the changes by the other processes are seen.
     """
 
-    def __init__(self, basedir_prefix, kind="cif"):
-        super().__init__(basedir_prefix)
+    # kinds of the structure file which place_files() writes
+    STRUCTUREFILE_KINDS = ["cif", "poscar", "npy"]
+
+    def __init__(self, basedir_prefix, kind="cif", lazy=False,
+                 write_back=False, fsync=False, store=None):
+        if kind not in self.STRUCTUREFILE_KINDS:
+            raise ValueError("kind must be one of {}, but {}".format(
+                self.STRUCTUREFILE_KINDS, kind))
+        # (current directory, metadata) kept in memory
+        self.__metadata = None
+        self.__dirty = False
+        self.write_back = write_back
+
+        super().__init__(basedir_prefix, lazy=lazy, fsync=fsync, store=store)
 
         self.metadata_file = "metadata.json"
-        self.structurefile_kind = "cif"
+        self.structurefile_kind = kind
         self.cif_filename = "subs.cif"
+        self.npy_filename = "subs.npy"
 
     def as_dict(self):
         """get information as dict
@@ -303,6 +448,7 @@ class StructureNode(DirNode):
         -------
         dict: information of the content
         """
+        self.flush()
         dic = super().as_dict()
         current_dir = self.get_currentdir()
 
@@ -319,16 +465,54 @@ class StructureNode(DirNode):
             dic.update({"positionfile": structure_file,
                         "species": species, "nspecies": len(species)})
 
-        metadata_file = os.path.join(current_dir, self.metadata_file)
-        with open(metadata_file) as f:
-            d = json.loads(f.read())
-            dic.update(d)
+        dic.update(self.load_currentdir_metadata())
 
         return dic
 
+    def load_structure(self, cache=None):
+        """load the structure of the current directory
+
+        The file is parsed through StructureCache.
+
+        Parameters
+        ----------
+        cache: StructureCache (default: None)
+            cache to use, structure_cache if None
+
+        Returns
+        -------
+        SubsStructure
+        """
+        metadata = self.load_currentdir_metadata()
+        positionpath = os.path.join(self.get_currentdir(),
+                                    metadata["positionfile"])
+        return SubsStructure.from_file_cached(positionpath, cache=cache)
+
+    def export_cif(self, filename=None):
+        """write the structure of the current directory as a cif file
+
+        It is used when the structure is saved in the other kind.
+
+        Parameters
+        ----------
+        filename: string (default: None)
+            cif file name, self.cif_filename in the current directory if None
+
+        Returns
+        -------
+        string: cif file name
+        """
+        if filename is None:
+            filename = os.path.join(self.get_currentdir(), self.cif_filename)
+        CifWriter(self.load_structure()).write_file(filename)
+        return filename
+
     def save_currentdir_metadata(self, dic):
         """save dic into the currentdir metadata file
 
+        The file is written atomically,
+        or later by flush() if self.write_back is True.
+
         Parameters
         ----------
         dic: dict
@@ -340,9 +524,59 @@ class StructureNode(DirNode):
 
         """
         targetdir = self.get_currentdir()
+        if self.__metadata is not None and self.__metadata[0] != targetdir:
+            self.flush()
+        self.__metadata = (targetdir, dict(dic))
+        self.__dirty = True
+        if not self.write_back:
+            self.flush()
+
+    def flush(self):
+        """write the metadata changed in memory
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        boolean: True if the file is written
+        """
+        if not self.__dirty:
+            return False
+        targetdir, dic = self.__metadata
         filename = os.path.join(targetdir, self.metadata_file)
-        with open(filename, "w") as f:
-            f.write(json.dumps(dic))
+        self.store.write(filename, json.dumps(dic), fsync=self.fsync)
+        self.__dirty = False
+        self._clear_cache()
+        return True
+
+    @contextmanager
+    def metadata_batch(self):
+        """defer writes of the metadata in the with block
+
+        The metadata file is written once at the end of the block.
+        If an exception is raised in the block,
+        the changes are discarded.
+
+        Usage
+        -----
+        with node.metadata_batch():
+            node.update_currentdir_metadata({"achievement": "running"})
+            node.update_currentdir_metadata({"worker": "host:123"})
+        """
+        write_back = self.write_back
+        self.write_back = True
+        try:
+            yield self
+        except BaseException:
+            if self.__dirty:
+                self.__metadata = None
+                self.__dirty = False
+            raise
+        finally:
+            self.write_back = write_back
+        self.flush()
 
     def load_currentdir_metadata(self):
         """load currentdir metadata file
@@ -357,10 +591,14 @@ class StructureNode(DirNode):
 
         """
         targetdir = self.get_currentdir()
-        filename = os.path.join(targetdir, self.metadata_file)
-        with open(filename) as f:
-            dic = json.loads(f.read())
-        return dic
+        if not self.write_back or self.__metadata is None or \
+                self.__metadata[0] != targetdir:
+            self.flush()
+            filename = os.path.join(targetdir, self.metadata_file)
+            self.__metadata = (targetdir,
+                               json.loads(self.store.read(filename)))
+        # a copy, so that the one in memory isn't changed
+        return dict(self.__metadata[1])
 
     def update_currentdir_metadata(self, dic):
         """update currentdir metadata file
@@ -384,12 +622,14 @@ class StructureNode(DirNode):
 
         Parameters
         ----------
-        structure: pymatgen.structure
+        structure: pymatgen.structure or StructureRecord
             material structure
         source_uuid : string
             uuid file
         metadata: dic
             metadata to add
+            Its "fingerprint", if any, is saved instead of making one
+            by structure_fingerprint().
 
         Returns
         -------
@@ -397,10 +637,14 @@ class StructureNode(DirNode):
                  False if not created
         """
 
-        super_place_files = super().place_files()
+        # the basedir metadata file is changed after the step is complete
+        super_place_files = self._make_step()
 
         if super_place_files:
 
+            if isinstance(structure, StructureRecord):
+                structure = structure.to_structure()
+
             targetdir = self.get_currentdir()
             if source_uuid is not None:
                 dic = {"source_uuid": source_uuid}
@@ -418,6 +662,12 @@ class StructureNode(DirNode):
                 cifpath = os.path.join(targetdir, ciffilename)
                 cifwriter = CifWriter(structure)
                 cifwriter.write_file(cifpath)
+            elif kind == "npy":
+                # as numpy arrays, see structure_to_npy()
+                npyfilename = self.npy_filename
+                dic.update({"positionfile": npyfilename})
+                npypath = os.path.join(targetdir, npyfilename)
+                structure_to_npy(structure, npypath)
             else:
                 # as POSCAR
                 poscarfilename = "POSCAR"
@@ -426,9 +676,16 @@ class StructureNode(DirNode):
                 poscar = Poscar(structure)
                 poscar.write_file(poscarpath)
 
-            species = element_list(structure.species)
+            species = element_list(structure.species, order="hill")
             dic.update({"species": species, "nspecies": len(species)})
+            if "fingerprint" not in dic:
+                # it costs a symmetry search, so given one is used
+                dic.update({"fingerprint": structure_fingerprint(structure)})
             self.save_currentdir_metadata(dic)
+            # written now even in metadata_batch(),
+            # the step must have its metadata file when it becomes current
+            self.flush()
+            self.save_basedir_metadata_file()
             return True
         else:
             return False
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import fnmatch
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+
+def _has_magic(name):
+    return any(c in name for c in "*?[")
+
+
+def iter_dirs(location):
+    """iterate directories matched with location by os.scandir()
+
+    It is the same as the directories of glob.glob(location),
+    but the type of an entry is known by os.scandir() without stat.
+
+    Parameters
+    ----------
+    location: string
+        glob pattern, e.g., "Calc/MGI/*"
+
+    Returns
+    -------
+    generator of string: directory names
+    """
+    parts = Path(location).parts
+    nstatic = 0
+    while nstatic < len(parts) and not _has_magic(parts[nstatic]):
+        nstatic += 1
+    base = os.path.join(*parts[:nstatic]) if nstatic > 0 else ""
+    patterns = parts[nstatic:]
+
+    def walk(dirname, i):
+        if i == len(patterns):
+            yield dirname
+            return
+        pattern = patterns[i]
+        if not _has_magic(pattern):
+            path = os.path.join(dirname, pattern)
+            if os.path.isdir(path):
+                yield from walk(path, i + 1)
+            return
+        try:
+            with os.scandir(dirname or ".") as it:
+                entries = sorted(it, key=lambda x: x.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for entry in entries:
+            # hidden entries only by a hidden pattern as glob does
+            if entry.name.startswith(".") and not pattern.startswith("."):
+                continue
+            if fnmatch.fnmatchcase(entry.name, pattern) and \
+                    entry.is_dir():
+                yield from walk(os.path.join(dirname, entry.name), i + 1)
+
+    if len(patterns) == 0:
+        if os.path.isdir(location):
+            yield location
+        return
+    yield from walk(base, 0)
+
+
+def match_dir(location, dirname):
+    """return True if dirname is matched with location as iter_dirs() does
+
+    Unlike fnmatch.fnmatch(), "*" doesn't match "/",
+    so "Calc/MGI/*" doesn't match "Calc/MGI/a/b".
+
+    Parameters
+    ----------
+    location: string
+        glob pattern, e.g., "Calc/MGI/*"
+
+    dirname: string
+        directory name
+
+    Returns
+    -------
+    boolean
+    """
+    patterns = Path(location).parts
+    parts = Path(dirname).parts
+    if len(patterns) != len(parts):
+        return False
+    for pattern, name in zip(patterns, parts):
+        if not _has_magic(pattern):
+            if name != pattern:
+                return False
+            continue
+        # hidden entries only by a hidden pattern as glob does
+        if name.startswith(".") and not pattern.startswith("."):
+            return False
+        if not fnmatch.fnmatchcase(name, pattern):
+            return False
+    return True
+
+
+class DirScanner(object):
+    """read many directories concurrently by a thread pool
+
+    The reads of small files are latency bound on network file systems,
+    so they are overlapped in threads.
+    At most max_inflight directories are read at a time,
+    and the results are yielded in the order of the directories.
+    """
+
+    def __init__(self, func, max_workers=8, max_inflight=None):
+        """initialize DirScanner
+
+        Parameters
+        ----------
+        func: function
+            func(dirname) makes the result of a directory,
+            e.g., SubsMaterialsDatabase.make_dir_document
+
+        max_workers: int
+            the number of threads
+
+        max_inflight: int (default: None)
+            the maximum number of directories read at a time,
+            4 * max_workers if None
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be positive, "
+                             "but {}".format(max_workers))
+        self.func = func
+        self.max_workers = max_workers
+        if max_inflight is None:
+            max_inflight = 4 * max_workers
+        self.max_inflight = max(max_inflight, 1)
+
+    def _call(self, dirname):
+        """return (func(dirname), None) or (None, exception)
+        """
+        try:
+            return self.func(dirname), None
+        except Exception as e:
+            return None, e
+
+    def scan_serial(self, dirlist):
+        """read directories one by one in this thread
+
+        The same as scan() without threads.
+        """
+        for dirname in dirlist:
+            yield (dirname,) + self._call(dirname)
+
+    def scan(self, dirlist):
+        """read directories
+
+        Parameters
+        ----------
+        dirlist: iterable of string
+            directory names, e.g., iter_dirs(location)
+
+        Returns
+        -------
+        generator of (string, result, Exception):
+            (dirname, func(dirname), None) if succeeded,
+            (dirname, None, exception) otherwise
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            inflight = deque()
+            for dirname in dirlist:
+                inflight.append((dirname,
+                                 executor.submit(self._call, dirname)))
+                if len(inflight) >= self.max_inflight:
+                    dirname, future = inflight.popleft()
+                    yield (dirname,) + future.result()
+            while len(inflight) > 0:
+                dirname, future = inflight.popleft()
+                yield (dirname,) + future.result()
@@ -1,15 +1,137 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
 from typing import Union, List, Sequence
 
 from pymatgen.core.composition import Composition
 from pymatgen.core.lattice import Lattice
 from pymatgen.core.structure import Structure
-from pymatgen.core.periodic_table import Element, Specie, DummySpecie
+from pymatgen.core.periodic_table import (Element, Specie, DummySpecie,
+                                          get_el_sp)
+
+from .misc import atomic_write, element_list, sort_element_list
+
+
+def structure_fingerprint(structure):
+    """make a cheap fingerprint of structure
+
+    Structures which StructureMatcher() with the default parameters
+    regards as the same have the same reduced formula and the same number
+    of sites of get_primitive_structure(), which the matcher also uses;
+    it doesn't fit reduced structures of different numbers of sites
+    unless attempt_supercell=True.
+    The space group is not used because it changes
+    within the tolerances of the matcher,
+    and the lattice isn't because the matcher reduces and scales it.
+
+    Parameters
+    ----------
+    structure: pymatgen.Structure
+        material structure
+
+    Returns
+    -------
+    dict: {"reduced_formula": string, "natoms": int, "key": string}
+        key is "reduced_formula:natoms"
+    """
+    reduced_formula = structure.composition.reduced_formula
+    natoms = len(structure.get_primitive_structure())
+    key = "{}:{}".format(reduced_formula, natoms)
+    return {"reduced_formula": reduced_formula, "natoms": natoms,
+            "key": key}
+
+
+def write_npy(filename, lattice, species, frac_coords):
+    """write the arrays of a structure as a numpy .npy file
+
+    The file is a standard .npy file of a single record
+    of a structured array with the fields
+    "lattice" (3x3), "species" (nsites strings)
+    and "frac_coords" (nsites x 3),
+    so np.load() reads all of them and read_npy() needs no text parsing.
+    It is read several times faster than an .npz file,
+    which is a zip archive.
+
+    Parameters
+    ----------
+    filename: string
+        file name, which should end with ".npy"
+
+    lattice: np.array (3, 3)
+        lattice matrix
+
+    species: a list of string
+        species of the sites
+
+    frac_coords: np.array (nsites, 3)
+        fractional coordinates
+
+    Returns
+    -------
+    None
+    """
+    species = np.array([str(x) for x in species])
+    nsites = species.shape[0]
+    record = np.empty((), dtype=[("lattice", np.float64, (3, 3)),
+                                 ("species", species.dtype, (nsites,)),
+                                 ("frac_coords", np.float64, (nsites, 3))])
+    record["lattice"] = lattice
+    record["species"] = species
+    record["frac_coords"] = frac_coords
+    np.save(filename, record, allow_pickle=False)
+
+
+def read_npy(filename):
+    """read the arrays of a structure written by write_npy()
 
-from .misc import element_list
+    Parameters
+    ----------
+    filename: string
+        .npy file name
+
+    Returns
+    -------
+    (np.array (3, 3), a list of string, np.array (nsites, 3)):
+        lattice, species and frac_coords
+    """
+    with open(filename, "rb") as f:
+        record = np.load(f, allow_pickle=False)
+        if record.dtype.names is None:
+            # three arrays in sequence, written by older versions
+            species = np.load(f, allow_pickle=False)
+            frac_coords = np.load(f, allow_pickle=False)
+            return record, species.tolist(), frac_coords
+    return (record["lattice"], record["species"].tolist(),
+            record["frac_coords"])
+
+
+def structure_to_npy(structure, filename):
+    """save structure as a numpy .npy file
+
+    See write_npy().
+    Site properties are not saved.
+
+    Parameters
+    ----------
+    structure: pymatgen.Structure
+        material structure
+
+    filename: string
+        file name, which should end with ".npy"
+
+    Returns
+    -------
+    None
+    """
+    write_npy(filename, structure.lattice.matrix, structure.species,
+              structure.frac_coords)
 
 
 class SubsStructure(Structure):
@@ -32,9 +154,133 @@ class SubsStructure(Structure):
             coords_are_cartesian=coords_are_cartesian,
             site_properties=site_properties)
 
+    @classmethod
+    def from_file(cls, filename, *args, **kwargs):
+        """read a structure file
+
+        A .npy file is read by from_npy(),
+        and the others by Structure.from_file().
+
+        Parameters
+        ----------
+        filename: string
+            structure file name
+
+        args, kwargs:
+            passed to Structure.from_file()
+
+        Returns
+        -------
+        SubsStructure
+        """
+        if str(filename).endswith(".npy"):
+            return cls.from_npy(filename)
+        return super().from_file(filename, *args, **kwargs)
+
+    @classmethod
+    def from_npy(cls, filename):
+        """read a .npy file made by write_npy()
+
+        Parameters
+        ----------
+        filename: string
+            .npy file name
+
+        Returns
+        -------
+        SubsStructure
+        """
+        lattice, species, frac_coords = read_npy(filename)
+        return cls(Lattice(lattice), species, frac_coords)
+
+    def to_npy(self, filename):
+        """save the structure as a .npy file
+
+        call external structure_to_npy()
+
+        Parameters
+        ----------
+        filename: string
+            .npy file name
+
+        Returns
+        -------
+        None
+        """
+        structure_to_npy(self, filename)
+
+    @classmethod
+    def from_file_cached(cls, filename, cache=None, copy=True):
+        """read a structure file through StructureCache
+
+        Parameters
+        ----------
+        filename: string
+            structure file name
+
+        cache: StructureCache (default: None)
+            cache to use, structure_cache if None
+
+        copy: boolean
+            return a copy of the cached structure
+
+        Returns
+        -------
+        SubsStructure
+        """
+        if cache is None:
+            cache = structure_cache
+        return cache.get(filename, copy=copy)
+
+    @staticmethod
+    def substitution_mapping(subs_elems):
+        """make a function to map an element name by subs_elems
+
+        The pairs are applied in order as substitute_elements() does,
+        e.g., [["Fe","Cu"],["Cu","Co"]] maps both Fe and Cu to Co.
+
+        Parameters
+        ----------
+        subs_elems: a list of a list
+            elements to substitute
+            e.g., [["Cu","Co"],["Yb","Sm"]]
+
+        Returns
+        -------
+        function: element name -> element name
+        """
+        def mapping(name):
+            for elem1, elem2 in subs_elems:
+                if name == elem1:
+                    name = elem2
+            return name
+        return mapping
+
+    @staticmethod
+    def _substitute_specie(specie, mapping):
+        """substitute the element of a specie
+
+        Element, Specie and DummySpecie keep the other attributes,
+        e.g., the oxidation state.
+        """
+        if isinstance(specie, Element):
+            name = mapping(specie.symbol)
+            if name == specie.symbol:
+                return specie
+            return Element(name)
+        dic = specie.as_dict()
+        name = mapping(dic["element"])
+        if name == dic["element"]:
+            return specie
+        dic["element"] = name
+        return type(specie).from_dict(dic)
+
     def substitute_elements(self, subs_elems):
         """substitute elements specified by subs_elems
 
+        The species of the sites are changed directly
+        without the as_dict()/from_dict() round trip.
+
         Parameters
         ----------
         structure: Structure
@@ -48,34 +294,57 @@ class SubsStructure(Structure):
         -------
         Structure: substituted Structure object
         """
+        return self.substitute_elements_batch([subs_elems])[0]
 
-        struc_dic = self.as_dict()
-        sites = struc_dic["sites"]
-        for elem1, elem2 in subs_elems:
+    def substitute_elements_batch(self, subs_elems_list):
+        """make substituted structures for each subs_elems in subs_elems_list
 
-            sites2 = []
-            for x in sites:
-                label = {"label": x["label"]}
-                if x["label"] == elem1:
-                    label = {"label": elem2}
+        The lattice, the coordinates and the site properties are read
+        only once.
 
-                specie = x["species"]
-                specie2 = []
-                for specie0 in specie:
-                    if specie0["element"] == elem1:
-                        specie0["element"] = elem2
-                    specie2.append(specie0)
-                specie = specie2
-
-                x.update(label)
-                x.update({"species": specie})
-                sites2.append(x)
-
-            sites = sites2
+        Parameters
+        ----------
+        subs_elems_list: a list of subs_elems
+            e.g., [[["Cu","Co"]], [["Cu","Fe"],["Yb","Sm"]]]
 
-        struc_dic["sites"] = sites
+        Returns
+        -------
+        a list of SubsStructure
+            the same as [self.substitute_elements(x)
+                         for x in subs_elems_list]
+        """
+        lattice = self.lattice
+        frac_coords = self.frac_coords
+        site_properties = self.site_properties
+        charge = self.charge
+        site_species = [site.species for site in self]
+        unique_species = set()
+        for comp in site_species:
+            unique_species.update(comp.keys())
+        labels = None
+        if len(self) > 0 and hasattr(self[0], "label"):
+            labels = [site.label for site in self]
 
-        return SubsStructure.from_dict(struc_dic)
+        structures = []
+        for subs_elems in subs_elems_list:
+            mapping = self.substitution_mapping(subs_elems)
+            specie_map = {sp: self._substitute_specie(sp, mapping)
+                          for sp in unique_species}
+            species = []
+            for comp in site_species:
+                new_comp = {}
+                for sp, occu in comp.items():
+                    new_sp = specie_map[sp]
+                    new_comp[new_sp] = new_comp.get(new_sp, 0) + occu
+                species.append(new_comp)
+            new_struc = SubsStructure(lattice, species, frac_coords,
+                                      charge=charge,
+                                      site_properties=site_properties)
+            if labels is not None:
+                for site, label in zip(new_struc, labels):
+                    site.label = mapping(label)
+            structures.append(new_struc)
+        return structures
 
     def randomize_structure(self):
         """make new structure with random modification
@@ -147,18 +416,655 @@ class SubsStructure(Structure):
                                  coords_are_cartesian=False)
         return newstruc
 
-    def element_list(self):
+    def randomize_structures(self, n, rng=None, seeds=None,
+                             afac=0.1, alphafac=2, fac=0.01):
+        """make n structures with random modification at once
+
+        The modification is the same as randomize_structure(),
+        but the random numbers of all the structures are drawn at once
+        from a numpy.random.Generator.
+        SubsStructure objects are made only when they are accessed.
+
+        Parameters
+        ----------
+        n: int
+            the number of structures
+
+        rng: numpy.random.Generator (default: None)
+            random number generator, numpy.random.default_rng() if None
+
+        seeds: a list of int (default: None)
+            a seed of each structure.
+            The i-th structure is reproducible by seeds[i] alone,
+            independent of n and the other seeds.
+            rng is not used if seeds is given.
+
+        afac: float
+            a factor for lattice length modification
+
+        alphafac: float
+            a factor for lattice angle modification
+
+        fac: float
+            factor for random displacement
+
+        Returns
+        -------
+        PerturbedStructures
+        """
+        matrices, frac_coords = perturb_arrays(
+            self.lattice, self.frac_coords, n, rng=rng, seeds=seeds,
+            afac=afac, alphafac=alphafac, fac=fac)
+        return PerturbedStructures(matrices, self.species, frac_coords)
+
+    def fingerprint(self):
+        """make a cheap fingerprint to prefilter StructureMatcher
+
+        call external structure_fingerprint()
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict: see structure_fingerprint()
+        """
+        return structure_fingerprint(self)
+
+    def element_list(self, order="hill"):
         """make species of material
 
         call external element_list()
 
         Parameters
         ----------
-        structure: pymatgen.Structure
-            material structure
+        order: string
+            canonical order of the species, see misc.sort_element_list()
+            None keeps the order of the first appearance.
 
         Returns
         -------
         species: dict (Structure.species)
         """
-        return element_list(self.species)
+        return element_list(self.species, order=order)
+
+
+def lattice_matrices_from_parameters(abc, angles):
+    """make lattice matrices from lattice parameters at once
+
+    The same as Lattice.from_parameters(*abc[i], *angles[i]).matrix.
+
+    Parameters
+    ----------
+    abc: np.array (n, 3)
+        lattice lengths
+
+    angles: np.array (n, 3)
+        lattice angles in degree
+
+    Returns
+    -------
+    np.array (n, 3, 3)
+        lattice matrices
+    """
+    abc = np.asarray(abc, dtype=float)
+    angles_r = np.radians(np.asarray(angles, dtype=float))
+    a, b, c = abc[:, 0], abc[:, 1], abc[:, 2]
+    cos_alpha, cos_beta, cos_gamma = np.cos(angles_r).T
+    sin_alpha, sin_beta = np.sin(angles_r[:, 0]), np.sin(angles_r[:, 1])
+
+    val = (cos_alpha * cos_beta - cos_gamma) / (sin_alpha * sin_beta)
+    val = np.clip(val, -1, 1)
+    gamma_star = np.arccos(val)
+
+    matrices = np.zeros((abc.shape[0], 3, 3))
+    matrices[:, 0, 0] = a * sin_beta
+    matrices[:, 0, 2] = a * cos_beta
+    matrices[:, 1, 0] = -b * sin_alpha * np.cos(gamma_star)
+    matrices[:, 1, 1] = b * sin_alpha * np.sin(gamma_star)
+    matrices[:, 1, 2] = b * cos_alpha
+    matrices[:, 2, 2] = c
+    return matrices
+
+
+def perturb_arrays(lattice, frac_coords, n, rng=None, seeds=None,
+                   afac=0.1, alphafac=2, fac=0.01):
+    """make n lattices and fractional coordinates with random modification
+
+    See SubsStructure.randomize_structures() for the parameters.
+
+    Parameters
+    ----------
+    lattice: pymatgen.Lattice
+        lattice to modify
+
+    frac_coords: np.array (nsites, 3)
+        fractional coordinates to modify
+
+    Returns
+    -------
+    (np.array (n, 3, 3), np.array (n, nsites, 3))
+        lattice matrices and fractional coordinates
+    """
+    nsites = frac_coords.shape[0]
+    if seeds is not None:
+        if len(seeds) != n:
+            raise ValueError("len(seeds) must be n={}, "
+                             "but {}".format(n, len(seeds)))
+        r = np.empty((n, 6))
+        rr = np.empty((n, nsites, 3))
+        for i, seed in enumerate(seeds):
+            rng_i = np.random.default_rng(seed)
+            r[i] = rng_i.random(6)
+            rr[i] = rng_i.random((nsites, 3))
+    else:
+        if rng is None:
+            rng = np.random.default_rng()
+        r = rng.random((n, 6))
+        rr = rng.random((n, nsites, 3))
+
+    abc = np.array(lattice.abc) + r[:, :3] * afac
+    angles = np.array(lattice.angles) + r[:, 3:] * alphafac
+    matrices = lattice_matrices_from_parameters(abc, angles)
+
+    rr = rr * fac
+    if nsites > 0:
+        rr[:, 0, :] = 0
+    return matrices, frac_coords[np.newaxis, :, :] - rr
+
+
+class PerturbedStructures(object):
+    """structures made by SubsStructure.randomize_structures()
+
+    It holds the lattice matrices and the fractional coordinates as arrays.
+    A SubsStructure is made when it is accessed by [i] or iteration.
+    """
+
+    def __init__(self, lattices, species, frac_coords):
+        """initialize PerturbedStructures
+
+        Parameters
+        ----------
+        lattices: np.array (n, 3, 3)
+            lattice matrices
+
+        species: a list of species
+            species of the sites, common to all the structures
+
+        frac_coords: np.array (n, nsites, 3)
+            fractional coordinates
+        """
+        self.lattices = lattices
+        self.species = species
+        self.frac_coords = frac_coords
+
+    def __len__(self):
+        return self.lattices.shape[0]
+
+    def __getitem__(self, i):
+        return SubsStructure(lattice=self.lattices[i], species=self.species,
+                             coords=self.frac_coords[i],
+                             coords_are_cartesian=False)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class StructureRecord(object):
+    """compact structure for pipelines with many structures
+
+    It holds only arrays and no Site objects,
+    lattice (3, 3), species_index (nsites,) of symbols
+    and frac_coords (nsites, 3).
+    Only ordered structures are supported.
+    The arrays may be shared with other records,
+    so they must not be changed in place.
+    """
+
+    __slots__ = ("lattice", "symbols", "species_index", "frac_coords",
+                 "site_properties")
+
+    def __init__(self, lattice, symbols, species_index, frac_coords,
+                 site_properties=None):
+        """initialize StructureRecord
+
+        Parameters
+        ----------
+        lattice: np.array (3, 3)
+            lattice matrix
+
+        symbols: a list of string
+            species names, e.g., ["Yb", "Fe2+"]
+
+        species_index: np.array (nsites,) of int
+            index of symbols of each site
+
+        frac_coords: np.array (nsites, 3)
+            fractional coordinates
+
+        site_properties: dict (default: None)
+            site properties as Structure.site_properties
+        """
+        self.lattice = np.asarray(lattice, dtype=float)
+        self.symbols = list(symbols)
+        self.species_index = np.asarray(species_index, dtype=np.int32)
+        self.frac_coords = np.asarray(frac_coords, dtype=float)
+        if site_properties is None:
+            site_properties = {}
+        self.site_properties = site_properties
+
+    @classmethod
+    def from_species(cls, lattice, species, frac_coords,
+                     site_properties=None):
+        """make StructureRecord from species of the sites
+
+        Parameters
+        ----------
+        lattice: np.array (3, 3)
+            lattice matrix
+
+        species: a list of species or string
+            species of the sites
+
+        frac_coords: np.array (nsites, 3)
+            fractional coordinates
+
+        site_properties: dict (default: None)
+            site properties
+
+        Returns
+        -------
+        StructureRecord
+        """
+        position = {}
+        species_index = np.empty(len(species), dtype=np.int32)
+        for i, x in enumerate(species):
+            species_index[i] = position.setdefault(str(x), len(position))
+        return cls(lattice, list(position), species_index, frac_coords,
+                   site_properties=site_properties)
+
+    @classmethod
+    def from_structure(cls, structure):
+        """make StructureRecord from pymatgen.Structure
+
+        Parameters
+        ----------
+        structure: pymatgen.Structure
+            ordered structure
+
+        Returns
+        -------
+        StructureRecord
+        """
+        if not structure.is_ordered:
+            raise ValueError("StructureRecord supports only "
+                             "ordered structures")
+        site_properties = {k: list(v) for k, v in
+                           structure.site_properties.items()}
+        return cls.from_species(structure.lattice.matrix.copy(),
+                                structure.species,
+                                structure.frac_coords.copy(),
+                                site_properties=site_properties)
+
+    @classmethod
+    def from_file(cls, filename):
+        """read a structure file
+
+        A .npy file made by write_npy() is read into the arrays
+        without making a Structure.
+
+        Parameters
+        ----------
+        filename: string
+            structure file name
+
+        Returns
+        -------
+        StructureRecord
+        """
+        if str(filename).endswith(".npy"):
+            return cls.from_species(*read_npy(filename))
+        return cls.from_structure(SubsStructure.from_file(filename))
+
+    def __len__(self):
+        return self.species_index.shape[0]
+
+    @property
+    def species(self):
+        """species names of the sites
+        """
+        return [self.symbols[i] for i in self.species_index]
+
+    def to_structure(self, structure_class=SubsStructure):
+        """make a structure
+
+        Parameters
+        ----------
+        structure_class: class
+            class of the structure
+
+        Returns
+        -------
+        structure_class
+        """
+        return structure_class(Lattice(self.lattice), self.species,
+                               self.frac_coords,
+                               site_properties=self.site_properties or None)
+
+    def write(self, filename):
+        """write the structure to a file
+
+        A .npy file is written from the arrays by write_npy(),
+        and the others by Structure.to().
+
+        Parameters
+        ----------
+        filename: string
+            file name
+
+        Returns
+        -------
+        None
+        """
+        if str(filename).endswith(".npy"):
+            write_npy(filename, self.lattice, self.species, self.frac_coords)
+        else:
+            self.to_structure().to(filename=filename)
+
+    def substitute_elements(self, subs_elems):
+        """substitute elements specified by subs_elems
+
+        Only symbols and species_index are made.
+        The other arrays are shared with self.
+
+        Parameters
+        ----------
+        subs_elems: a list of a list
+            elements to substitute
+            e.g., [["Cu","Co"],["Yb","Sm"]]
+
+        Returns
+        -------
+        StructureRecord
+        """
+        mapping = SubsStructure.substitution_mapping(subs_elems)
+        new_symbols = [
+            str(SubsStructure._substitute_specie(get_el_sp(x), mapping))
+            for x in self.symbols]
+        position = {}
+        remap = np.array([position.setdefault(x, len(position))
+                          for x in new_symbols], dtype=np.int32)
+        return StructureRecord(self.lattice, list(position),
+                               remap[self.species_index], self.frac_coords,
+                               site_properties=self.site_properties)
+
+    def randomize_structures(self, n, rng=None, seeds=None,
+                             afac=0.1, alphafac=2, fac=0.01):
+        """make n structures with random modification at once
+
+        See SubsStructure.randomize_structures() for the parameters.
+
+        Returns
+        -------
+        a list of StructureRecord
+        """
+        matrices, frac_coords = perturb_arrays(
+            Lattice(self.lattice), self.frac_coords, n, rng=rng,
+            seeds=seeds, afac=afac, alphafac=alphafac, fac=fac)
+        return [StructureRecord(matrices[i], self.symbols,
+                                self.species_index, frac_coords[i],
+                                site_properties=self.site_properties)
+                for i in range(n)]
+
+    def element_list(self, order="hill"):
+        """make species of material
+
+        Parameters
+        ----------
+        order: string
+            canonical order of the species, see misc.sort_element_list()
+            None keeps the order of the first appearance.
+
+        Returns
+        -------
+        species: a list of [string, int]
+        """
+        counts = np.bincount(self.species_index,
+                             minlength=len(self.symbols))
+        elementlist = [[x, int(n)] for x, n in zip(self.symbols, counts)
+                       if n > 0]
+        if order is None:
+            return elementlist
+        return sort_element_list(elementlist, order)
+
+    def fingerprint(self):
+        """make a cheap fingerprint to prefilter StructureMatcher
+
+        The same as structure_fingerprint() of to_structure().
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict: see structure_fingerprint()
+        """
+        return structure_fingerprint(self.to_structure())
+
+
+class StructureCache(object):
+    """LRU cache of parsed structures
+
+    A structure is keyed by (real path, mtime, size) of the file,
+    so that a changed file is parsed again.
+    If cachedir is given, parsed structures are also saved there as JSON
+    and read in later processes without parsing the file.
+    The files in cachedir are limited to max_cachefiles;
+    when it is exceeded, prune() removes the least recently used ones.
+    """
+
+    # prune() leaves this ratio of max_cachefiles
+    PRUNE_RATIO = 0.9
+
+    def __init__(self, maxsize=1024, cachedir=None,
+                 structure_class=SubsStructure, max_cachefiles=100000):
+        """initialize StructureCache
+
+        Parameters
+        ----------
+        maxsize: int
+            the maximum number of structures in memory
+
+        cachedir: string (default: None)
+            directory of the persisted cache, not persisted if None
+
+        structure_class: class
+            class to parse files by .from_file()
+
+        max_cachefiles: int (default: 100000)
+            the maximum number of files in cachedir, not limited if None
+        """
+        self.maxsize = maxsize
+        self.cachedir = cachedir
+        self.max_cachefiles = max_cachefiles
+        # the number of files in cachedir, counted when it is needed
+        self.__ncachefiles = None
+        self.structure_class = structure_class
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if cachedir is not None and not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def key(self, filename):
+        """make the key of filename
+
+        Parameters
+        ----------
+        filename: string
+            structure file name
+
+        Returns
+        -------
+        tuple: (real path, mtime in ns, size)
+        """
+        path = os.path.realpath(filename)
+        st = os.stat(path)
+        return (path, st.st_mtime_ns, st.st_size)
+
+    def __cachefile(self, key):
+        name = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.cachedir, name + ".json")
+
+    def __load(self, key):
+        # .npy is read faster than the JSON of the persisted cache
+        persist = self.cachedir is not None and not key[0].endswith(".npy")
+        if persist:
+            cachefile = self.__cachefile(key)
+            try:
+                with open(cachefile) as f:
+                    structure = self.structure_class.from_dict(
+                        json.loads(f.read()))
+                # the mtime tells prune() when it is used last
+                os.utime(cachefile)
+                with self.__lock:
+                    self.disk_hits += 1
+                return structure
+            except (FileNotFoundError, ValueError, KeyError):
+                # not cached yet or removed by prune()
+                pass
+        structure = self.structure_class.from_file(key[0])
+        with self.__lock:
+            self.misses += 1
+        if persist:
+            atomic_write(cachefile, json.dumps(structure.as_dict()))
+            self.__add_cachefile()
+        return structure
+
+    def __cachefiles(self):
+        """list (mtime in ns, file name) of the files in cachedir
+        """
+        files = []
+        with os.scandir(self.cachedir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    files.append((entry.stat().st_mtime_ns, entry.path))
+                except FileNotFoundError:
+                    pass
+        return files
+
+    def __add_cachefile(self):
+        """count a new file in cachedir and prune() if there are too many
+        """
+        if self.max_cachefiles is None:
+            return
+        with self.__lock:
+            if self.__ncachefiles is None:
+                self.__ncachefiles = len(self.__cachefiles())
+            else:
+                self.__ncachefiles += 1
+            over = self.__ncachefiles > self.max_cachefiles
+        if over:
+            self.prune()
+
+    def prune(self, max_cachefiles=None):
+        """remove the least recently used files in cachedir
+
+        PRUNE_RATIO of max_cachefiles are left,
+        so that it doesn't run every time a file is added.
+        It is safe to run while other processes use cachedir,
+        a removed file is parsed again.
+
+        Parameters
+        ----------
+        max_cachefiles: int (default: None)
+            the maximum number of files, self.max_cachefiles if None
+
+        Returns
+        -------
+        int: the number of removed files
+        """
+        if self.cachedir is None:
+            return 0
+        if max_cachefiles is None:
+            max_cachefiles = self.max_cachefiles
+        files = sorted(self.__cachefiles())
+        n = 0
+        if max_cachefiles is not None and len(files) > max_cachefiles:
+            nleft = int(max_cachefiles * self.PRUNE_RATIO)
+            for _, filename in files[:len(files) - nleft]:
+                try:
+                    os.remove(filename)
+                    n += 1
+                except FileNotFoundError:
+                    pass
+        with self.__lock:
+            self.__ncachefiles = len(files) - n
+        return n
+
+    def get(self, filename, copy=True):
+        """get the structure of filename
+
+        Parameters
+        ----------
+        filename: string
+            structure file name
+
+        copy: boolean
+            return a copy, so that the cached one isn't changed
+
+        Returns
+        -------
+        structure_class
+        """
+        key = self.key(filename)
+        with self.__lock:
+            structure = self.__data.get(key)
+            if structure is not None:
+                self.__data.move_to_end(key)
+                self.hits += 1
+        if structure is None:
+            structure = self.__load(key)
+            with self.__lock:
+                self.__data[key] = structure
+                self.__data.move_to_end(key)
+                while len(self.__data) > self.maxsize:
+                    self.__data.popitem(last=False)
+                    self.evictions += 1
+        if copy:
+            return structure.copy()
+        return structure
+
+    def clear(self):
+        """clear the structures in memory and the statistics
+        """
+        with self.__lock:
+            self.__data.clear()
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def info(self):
+        """return the statistics
+
+        Returns
+        -------
+        dict: hits, disk_hits, misses, evictions, size and maxsize
+        """
+        with self.__lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "size": len(self.__data), "maxsize": self.maxsize}
+
+
+# cache used by SubsStructure.from_file_cached() by default
+structure_cache = StructureCache()
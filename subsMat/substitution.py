@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from .database import make_lazy_node
+from .dedup import StructureDeduplicator
+from .node import subs_elms_to_prefix
+
+
+def _chunks(iterable, size):
+    """split iterable into lists of size elements
+    """
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _substitute(wrapperclass, basedir, subs_elm):
+    """load the structure of basedir and substitute elements
+
+    It runs in a worker process.
+
+    Returns
+    -------
+    (SubsStructure, dict): the new structure and its fingerprint
+    """
+    structure = make_lazy_node(wrapperclass, basedir).load_structure()
+    structure = structure.substitute_elements(subs_elm)
+    return structure, structure.fingerprint()
+
+
+def _place(wrapperclass, basedir, structure, source_uuid, metadata):
+    """place the structure in basedir
+
+    It runs in a worker process.
+    """
+    return wrapperclass(basedir).place_files(structure,
+                                             source_uuid=source_uuid,
+                                             metadata=metadata)
+
+
+class SubstitutionEngine(object):
+    """make substituted structures of all the materials in the database
+
+    A pair of a material and a substitution rule is processed
+    chunk_size pairs at a time as
+    substitution -> deduplication -> placement -> insertion into DB.
+    Substitution and placement run in a process pool.
+    The structures in the database compared with the new ones
+    are kept reduced in an LRU cache of max_references structures,
+    so that every chunk only loads and reduces the new references.
+    """
+
+    def __init__(self, subs_db, wrapperclass, metadata=None,
+                 chunk_size=100, max_workers=None, matcher_options=None,
+                 max_references=10000):
+        """initialization
+
+        Parameters
+        ----------
+        subs_db: SubsMaterialsDatabase
+            database of the materials
+
+        wrapperclass: class
+            a class to access the node
+            must has .load_structure(), .place_files() and .as_dict(),
+            lazy=True is passed if it accepts
+
+        metadata: dict (default: None)
+            metadata of new structures,
+            {"purpose": "converged_ionic", "achievement": "to_relax"} if None
+
+        chunk_size: int
+            the number of pairs processed at a time
+
+        max_workers: int (default: None)
+            the number of worker processes, os.cpu_count() if None
+            No process is made if it is 1.
+
+        matcher_options: dict (default: None)
+            options to pass StructureMatcher()
+
+        max_references: int
+            the number of reduced structures in the database kept in memory
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive, "
+                             "but {}".format(chunk_size))
+        self.subs_db = subs_db
+        self.wrapperclass = wrapperclass
+        if metadata is None:
+            metadata = {"purpose": "converged_ionic",
+                        "achievement": "to_relax"}
+        self.metadata = metadata
+        self.chunk_size = chunk_size
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.matcher_options = matcher_options
+        self.max_references = max_references
+        # {(basedir, uuid): (reduced structure, fingerprint)}
+        self.__references = OrderedDict()
+        self.report = None
+
+    def enumerate_pairs(self, subs_elm_list):
+        """enumerate pairs of a material and a substitution rule
+
+        A pair is skipped if its new basedir is already in the database
+        or in the file system.
+
+        Parameters
+        ----------
+        subs_elm_list: a list of subs_elm
+            substitution rules, e.g., [[["Cu", "Fe"]], [["Cu", "Ni"]]]
+
+        Returns
+        -------
+        generator of dict:
+            {"basedir", "uuid", "subs_elm", "new_basedir"},
+            or {"new_basedir", "skipped": True} for a skipped pair
+        """
+        def pairs():
+            for subs_elm in subs_elm_list:
+                prefix = subs_elms_to_prefix(subs_elm)
+                for x in self.subs_db.find_subs_elems(
+                        subs_elm, projection=["basedir", "uuid"],
+                        batch_size=self.chunk_size):
+                    yield {"basedir": x["basedir"], "uuid": x["uuid"],
+                           "subs_elm": subs_elm,
+                           "new_basedir": ",".join([x["basedir"], prefix])}
+
+        for chunk in _chunks(pairs(), self.chunk_size):
+            new_basedirs = [x["new_basedir"] for x in chunk]
+            existing = set([x["basedir"] for x in self.subs_db.find(
+                {"basedir": {"$in": new_basedirs}}, projection=["basedir"])])
+            for x in chunk:
+                if x["new_basedir"] in existing or \
+                        os.path.exists(x["new_basedir"]):
+                    yield {"new_basedir": x["new_basedir"], "skipped": True}
+                else:
+                    yield x
+
+    def _references(self, fingerprints, deduplicator, report):
+        """get the reduced structures in the database with the fingerprints
+
+        The database is searched every time,
+        and only the structures not in the cache are loaded and reduced.
+
+        Returns
+        -------
+        (a list of pymatgen.Structure, a list of dict):
+            reduced structures and fingerprints
+        """
+        field = deduplicator.fingerprint_field
+        docs = []
+        for key in set([x[field] for x in fingerprints]):
+            docs.extend(self.subs_db.find(
+                {"fingerprint." + field: key},
+                projection=["basedir", "uuid", "fingerprint"]))
+        cache = self.__references
+        new_docs = [y for y in docs if (y["basedir"], y["uuid"]) not in cache]
+        if len(new_docs) > 0:
+            structures = [make_lazy_node(self.wrapperclass,
+                                         y["basedir"]).load_structure()
+                          for y in new_docs]
+            for y, x in zip(new_docs, deduplicator.reduce(structures)):
+                cache[(y["basedir"], y["uuid"])] = (x, y["fingerprint"])
+            report["nreferences"] += len(new_docs)
+        references = []
+        reference_fingerprints = []
+        for y in docs:
+            key = (y["basedir"], y["uuid"])
+            cache.move_to_end(key)
+            references.append(cache[key][0])
+            reference_fingerprints.append(cache[key][1])
+        while len(cache) > self.max_references:
+            cache.popitem(last=False)
+        return references, reference_fingerprints
+
+    def _run_chunk(self, chunk, executor, deduplicator, report, verbose):
+        """substitute, deduplicate, place and insert a chunk of pairs
+
+        A pair which fails in substitution or placement is recorded
+        in report["errors"] and the rest of the chunk continues.
+        """
+        def call(func, args, new_basedirs):
+            # (result, None) or (None, exception) for each args
+            if executor is None:
+                futures = None
+            else:
+                futures = [executor.submit(func, *x) for x in args]
+            results = []
+            for i, x in enumerate(args):
+                try:
+                    if futures is None:
+                        results.append((func(*x), None))
+                    else:
+                        results.append((futures[i].result(), None))
+                except Exception as e:
+                    report["nfailed"] += 1
+                    report["errors"].append({"new_basedir": new_basedirs[i],
+                                             "errmsg": repr(e)})
+                    results.append((None, e))
+            return results
+
+        results = call(_substitute, [(self.wrapperclass, x["basedir"],
+                                      x["subs_elm"]) for x in chunk],
+                       [x["new_basedir"] for x in chunk])
+        chunk = [x for x, (_, e) in zip(chunk, results) if e is None]
+        results = [x for x, e in results if e is None]
+        structures = [x[0] for x in results]
+        fingerprints = [x[1] for x in results]
+
+        references, reference_fingerprints = self._references(
+            fingerprints, deduplicator, report)
+        matches = deduplicator.match(structures, references, fingerprints,
+                                     reference_fingerprints,
+                                     reduced_references=True)
+        candidates = [i for i, j in enumerate(matches) if j is None]
+        report["nmatched"] += len(structures) - len(candidates)
+
+        clusters = deduplicator.clusters(
+            [structures[i] for i in candidates],
+            [fingerprints[i] for i in candidates])
+        unique = [candidates[x[0]] for x in clusters]
+        report["nduplicates"] += len(candidates) - len(unique)
+
+        placed = call(_place, [(self.wrapperclass, chunk[i]["new_basedir"],
+                                structures[i], chunk[i]["uuid"],
+                                dict(self.metadata,
+                                     fingerprint=fingerprints[i]))
+                               for i in unique],
+                      [chunk[i]["new_basedir"] for i in unique])
+        new_basedirs = []
+        for i, (ret, error) in zip(unique, placed):
+            if error is not None:
+                continue
+            if ret:
+                new_basedirs.append(chunk[i]["new_basedir"])
+                if verbose:
+                    print("new_basedir", chunk[i]["new_basedir"])
+            else:
+                report["nfailed"] += 1
+                report["errors"].append({"new_basedir":
+                                         chunk[i]["new_basedir"],
+                                         "errmsg": "not placed"})
+        ret = self.subs_db.add_dirs_in_batches(new_basedirs,
+                                               self.wrapperclass,
+                                               batch_size=self.chunk_size)
+        report["nplaced"] += ret["ninserted"]
+        report["nfailed"] += ret["nfailed"]
+        for x in ret["errors"]:
+            report["errors"].append({"new_basedir": x["dirname"],
+                                     "errmsg": x["errmsg"]})
+
+    def run(self, subs_elm_list, verbose=False):
+        """make substituted structures for all the substitution rules
+
+        A new structure is placed unless it matches a structure
+        in the database or another new structure in the same chunk.
+        The report is also saved as self.report.
+
+        Parameters
+        ----------
+        subs_elm_list: a list of subs_elm
+            substitution rules, e.g., [[["Cu", "Fe"]], [["Cu", "Ni"]]]
+
+        verbose: boolean
+            print new basedirs and progress of every chunk
+
+        Returns
+        -------
+        dict: report
+            npairs, nskipped, nmatched, nduplicates, nplaced, nfailed,
+            nreferences (structures loaded from the database),
+            nchunks, elapsed and errors, a list of {"new_basedir", "errmsg"}
+        """
+        report = {"npairs": 0, "nskipped": 0, "nmatched": 0,
+                  "nduplicates": 0, "nplaced": 0, "nfailed": 0,
+                  "nreferences": 0, "nchunks": 0,
+                  "elapsed": 0.0, "errors": []}
+        start = time.time()
+
+        executor = None
+        if self.max_workers > 1:
+            executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        deduplicator = StructureDeduplicator(
+            max_workers=self.max_workers,
+            matcher_options=self.matcher_options, executor=executor)
+        try:
+            def pairs():
+                for x in self.enumerate_pairs(subs_elm_list):
+                    if x.get("skipped", False):
+                        report["nskipped"] += 1
+                        continue
+                    yield x
+
+            for chunk in _chunks(pairs(), self.chunk_size):
+                report["npairs"] += len(chunk)
+                report["nchunks"] += 1
+                self._run_chunk(chunk, executor, deduplicator, report,
+                                verbose)
+                if verbose:
+                    print("chunk {}: {} pairs, {} placed".format(
+                        report["nchunks"], report["npairs"],
+                        report["nplaced"]))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        report["npairs"] += report["nskipped"]
+        report["elapsed"] = time.time() - start
+        self.report = report
+        return report